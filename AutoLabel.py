@@ -5,18 +5,41 @@ from keras.layers import Dense, Dropout, Flatten
 from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split
 import joblib
+import json
+import os
 import random
+from instrumentation import traced
+
+# Emotion classes, in the column order of the model output
+EMOTION_CATEGORIES = ['happy', 'sad', 'energetic', 'calm', 'aggressive']
+
+# Threshold calibration: emotions with fewer validation positives than this keep the default
+# threshold, and calibrated thresholds never go below the floor
+DEFAULT_THRESHOLD = 0.5
+MIN_CALIBRATION_POSITIVES = 10
+MIN_THRESHOLD = 0.2
 
 class MusicEmotionClassifier:
     def __init__(self):
         self.model = None
         self.scaler = StandardScaler()
-        self.emotion_categories = ['happy', 'sad', 'energetic', 'calm', 'aggressive']
+        self.emotion_categories = list(EMOTION_CATEGORIES)
+        # Per-emotion probability thresholds, calibrated on validation data after training
+        self.thresholds = np.full(len(self.emotion_categories), DEFAULT_THRESHOLD)
+        # Identifies the loaded model weights, so cached predictions can be checked against them
+        self.model_tag = None
+        # Input features, in the column order the scaler and model are fitted on
+        self.feature_columns = ['danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness',
+                                'instrumentalness', 'liveness', 'valence', 'tempo', 'duration_ms', 'popularity']
         
+    @traced('preprocess_data')
     def preprocess_data(self, spotify_data_path):
         """Preprocess Spotify metadata for training"""
-        # Load Spotify metadata
-        df = pd.read_excel(spotify_data_path)
+        # Load Spotify metadata (an already loaded DataFrame is used as-is)
+        if isinstance(spotify_data_path, pd.DataFrame):
+            df = spotify_data_path
+        else:
+            df = pd.read_excel(spotify_data_path)
         
         # Extract audio features
         features = []
@@ -51,37 +74,25 @@ class MusicEmotionClassifier:
         return features_df, emotions
     
     def _assign_initial_emotions(self, features):
-        """Assign initial emotion labels based on audio features"""
-        emotions = []
-        
-        for _, row in features.iterrows():
-            # Simple rule-based classification
-            if row['energy'] > 0.7 and row['valence'] > 0.7:
-                emotion = 'happy'
-            elif row['energy'] < 0.4 and row['valence'] < 0.4:
-                emotion = 'sad'
-            elif row['energy'] > 0.8 and row['loudness'] > -5:
-                emotion = 'energetic'
-            elif row['energy'] < 0.4 and row['acousticness'] > 0.6:
-                emotion = 'calm'
-            elif row['energy'] > 0.7 and row['loudness'] > -4 and row['valence'] < 0.4:
-                emotion = 'aggressive'
-            else:
-                # Default to the most common category
-                emotion = 'energetic'
-                
-            emotions.append(emotion)
-        
-        # One-hot encode the emotions
-        emotions_df = pd.get_dummies(emotions)
-        
-        # Ensure all emotion categories are present
-        for emotion in self.emotion_categories:
-            if emotion not in emotions_df.columns:
-                emotions_df[emotion] = 0
-                
-        # Make sure to return a numpy array with the columns in the correct order
-        return emotions_df[self.emotion_categories].astype(float).values
+        """Assign initial emotion labels based on audio features (a track can have several)"""
+        energy = features['energy'].to_numpy(dtype=float)
+        valence = features['valence'].to_numpy(dtype=float)
+        loudness = features['loudness'].to_numpy(dtype=float)
+        acousticness = features['acousticness'].to_numpy(dtype=float)
+        
+        # Simple rule-based classification, one independent rule per emotion
+        rules = {
+            'happy': (energy > 0.7) & (valence > 0.7),
+            'sad': (energy < 0.4) & (valence < 0.4),
+            'energetic': (energy > 0.8) & (loudness > -5),
+            'calm': (energy < 0.4) & (acousticness > 0.6),
+            'aggressive': (energy > 0.7) & (loudness > -4) & (valence < 0.4)
+        }
+        labels = np.column_stack([rules[emotion] for emotion in self.emotion_categories]).astype(float)
+        
+        # Tracks no rule matches default to the most common category
+        labels[labels.sum(axis=1) == 0, self.emotion_categories.index('energetic')] = 1.0
+        return labels
     
     def build_model(self, input_shape):
         """Build the neural network model for emotion classification"""
@@ -90,15 +101,17 @@ class MusicEmotionClassifier:
         model.add(Dropout(0.3))
         model.add(Dense(32, activation='relu'))
         model.add(Dropout(0.3))
-        model.add(Dense(len(self.emotion_categories), activation='softmax'))
+        # One independent sigmoid per emotion, so a track can carry several
+        model.add(Dense(len(self.emotion_categories), activation='sigmoid'))
         
-        model.compile(loss='categorical_crossentropy', 
+        model.compile(loss='binary_crossentropy', 
                       optimizer='adam', 
-                      metrics=['accuracy'])
+                      metrics=['binary_accuracy'])
         
         self.model = model
         return model
     
+    @traced('train')
     def train(self, X, y, epochs=50, batch_size=32, validation_split=0.2):
         """Train the model on the preprocessed data"""
         # Scale features
@@ -126,13 +139,49 @@ class MusicEmotionClassifier:
         loss, accuracy = self.model.evaluate(X_test, y_test)
         print(f"Model accuracy: {accuracy:.4f}")
         
+        # Pick each emotion's decision threshold on the held-out data
+        self.calibrate_thresholds(X_test, y_test)
+        
         return history
     
+    def calibrate_thresholds(self, X_val_scaled, y_val, candidates=np.linspace(0.05, 0.95, 19)):
+        """Set each emotion's threshold to the candidate that maximizes its F1 score on validation data.
+
+        Candidates below MIN_THRESHOLD are ignored, F1 ties go to the candidate closest to
+        DEFAULT_THRESHOLD, and emotions with fewer than MIN_CALIBRATION_POSITIVES validation
+        positives keep DEFAULT_THRESHOLD.
+        """
+        probabilities = self.model.predict(X_val_scaled, verbose=0)
+        y_val = np.asarray(y_val) > 0.5
+        candidates = np.asarray(candidates)
+        candidates = candidates[candidates >= MIN_THRESHOLD]
+        for i, emotion in enumerate(self.emotion_categories):
+            if y_val[:, i].sum() < MIN_CALIBRATION_POSITIVES or len(candidates) == 0:
+                # Too few positives to calibrate against reliably
+                self.thresholds[i] = DEFAULT_THRESHOLD
+                continue
+            predicted = probabilities[:, i][:, None] >= candidates[None, :]
+            true_positives = (predicted & y_val[:, i][:, None]).sum(axis=0)
+            f1 = 2 * true_positives / (predicted.sum(axis=0) + y_val[:, i].sum())
+            best = np.flatnonzero(np.isclose(f1, f1.max()))
+            self.thresholds[i] = candidates[best[np.argmin(np.abs(candidates[best] - DEFAULT_THRESHOLD))]]
+        print("Calibrated thresholds: " + ", ".join(
+            f"{emotion} {threshold:.2f}" for emotion, threshold in zip(self.emotion_categories, self.thresholds)))
+        return self.thresholds
+    
+    @property
+    def multi_label(self):
+        """Whether the loaded model has the sigmoid multi-label head (older models use softmax)"""
+        return self.model is not None and self.model.layers[-1].activation.__name__ == 'sigmoid'
+    
     def save_model(self, model_path='emotion_classifier_model.h5', scaler_path='emotion_scaler.pkl'):
-        """Save the trained model and scaler"""
+        """Save the trained model and scaler, with the emotion thresholds next to the model"""
         if self.model is not None:
             self.model.save(model_path)
             joblib.dump(self.scaler, scaler_path)
+            with open(thresholds_path(model_path), 'w') as f:
+                json.dump(dict(zip(self.emotion_categories, map(float, self.thresholds))), f)
+            self.model_tag = get_model_tag(model_path)
             print(f"Model saved to {model_path} and scaler saved to {scaler_path}")
         else:
             print("No model to save. Train the model first.")
@@ -142,8 +191,15 @@ class MusicEmotionClassifier:
         from keras.models import load_model
         self.model = load_model(model_path)
         self.scaler = joblib.load(scaler_path)
+        # Models saved before thresholds were calibrated use 0.5 for every emotion
+        if os.path.exists(thresholds_path(model_path)):
+            with open(thresholds_path(model_path)) as f:
+                saved = json.load(f)
+            self.thresholds = np.array([saved.get(emotion, DEFAULT_THRESHOLD) for emotion in self.emotion_categories])
+        self.model_tag = get_model_tag(model_path)
         print(f"Model loaded from {model_path} and scaler loaded from {scaler_path}")
     
+    @traced('predict_emotion')
     def predict_emotion(self, features):
         """Predict emotion from audio features"""
         if self.model is None:
@@ -155,10 +211,63 @@ class MusicEmotionClassifier:
         # Predict
         predictions = self.model.predict(features_scaled)
         
-        # Get emotion labels
+        # Get the most likely emotion label for each track
         predicted_emotions = [self.emotion_categories[np.argmax(pred)] for pred in predictions]
         
         return predicted_emotions, predictions
+    
+    def emotion_labels(self, probabilities):
+        """All emotions at or above their threshold for each track, falling back to the most likely one"""
+        above = np.asarray(probabilities) >= self.thresholds
+        return [[emotion for emotion, keep in zip(self.emotion_categories, row) if keep]
+                or [self.emotion_categories[int(np.argmax(probs))]]
+                for row, probs in zip(above, probabilities)]
+
+def thresholds_path(model_path):
+    """Where the emotion thresholds for a model file are stored"""
+    return os.path.splitext(model_path)[0] + '_thresholds.json'
+
+def get_model_tag(model_path):
+    """Identify a saved model by its path and modification time"""
+    return f"{os.path.abspath(model_path)}@{os.path.getmtime(model_path):.6f}"
+
+def save_emotion_probabilities(path, track_ids, probabilities, emotion_categories, thresholds, model_tag=None,
+                               features=None, feature_columns=None):
+    """Store per-track emotion probabilities compactly (float16 matrix, compressed .npz).
+
+    features (float32, in feature_columns order) are the inputs the probabilities were
+    predicted from. The file is written under a temporary name and then renamed over
+    path, so an interrupted write never leaves a half-written cache behind.
+    """
+    extra = {}
+    if features is not None:
+        extra = {'features': np.asarray(features, dtype=np.float32), 'feature_columns': np.asarray(feature_columns)}
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f,
+                            track_ids=np.asarray(track_ids, dtype=str),
+                            probabilities=np.asarray(probabilities, dtype=np.float16),
+                            emotion_categories=np.asarray(emotion_categories),
+                            thresholds=np.asarray(thresholds, dtype=np.float32),
+                            model_tag=np.asarray(model_tag or ''),
+                            **extra)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def load_emotion_probabilities(path):
+    """Load probabilities stored by save_emotion_probabilities"""
+    with np.load(path) as data:
+        return {
+            'track_ids': data['track_ids'],
+            'probabilities': data['probabilities'],
+            'emotion_categories': data['emotion_categories'].tolist(),
+            'thresholds': data['thresholds'],
+            'model_tag': str(data['model_tag']),
+            # Caches written before features were stored have none
+            'features': data['features'] if 'features' in data else None,
+            'feature_columns': data['feature_columns'].tolist() if 'feature_columns' in data else None
+        }
 
 # Example usage
 if __name__ == "__main__":
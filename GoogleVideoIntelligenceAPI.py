@@ -2,31 +2,247 @@ from google.cloud import storage, videointelligence
 from google.oauth2 import service_account
 import pandas as pd
 import os
+import base64
+import hashlib
+import threading
 from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment
 from openpyxl.utils.dataframe import dataframe_to_rows
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import span, in_current_context
+from request_scheduler import video_intelligence_scheduler, cloud_storage_scheduler
+from checkpoint import IngestionCheckpoint, default_checkpoint_path
 
 # Load environment variables
 load_dotenv()
 
-# Get credentials file path from environment variable
-current_dir = os.path.dirname(os.path.abspath(__file__))
-key_path = os.path.join(current_dir, os.getenv('GOOGLE_APPLICATION_CREDENTIALS'))
-
-# Create a credentials object
-credentials = service_account.Credentials.from_service_account_file(key_path)
-
-# Use the credentials when creating the clients
-storage_client = storage.Client(credentials=credentials)
-video_client = videointelligence.VideoIntelligenceServiceClient(credentials=credentials)
+# Clients are created on first use so that importing this module needs no credentials
+storage_client = None
+video_client = None
+
+# Bucket handles reused across calls, keyed by bucket name
+bucket_handles = {}
+bucket_handles_lock = threading.Lock()
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi')
+
+# Chunk size for resumable uploads; must be a multiple of 256 KB
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+def _load_credentials():
+    """Load service account credentials from the file named in GOOGLE_APPLICATION_CREDENTIALS"""
+    # Get credentials file path from environment variable
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    key_path = os.path.join(current_dir, os.getenv('GOOGLE_APPLICATION_CREDENTIALS'))
+
+    # Create a credentials object
+    return service_account.Credentials.from_service_account_file(key_path)
+
+def get_storage_client():
+    """Return the Cloud Storage client, creating it with the service account credentials if needed"""
+    global storage_client
+    if storage_client is None:
+        if os.getenv('STORAGE_EMULATOR_HOST'):
+            # Local GCS emulator (e.g. fake-gcs-server); the client sends requests there without real credentials
+            from google.auth.credentials import AnonymousCredentials
+            storage_client = storage.Client(project=os.getenv('GOOGLE_CLOUD_PROJECT', 'test-project'),
+                                            credentials=AnonymousCredentials())
+        else:
+            storage_client = storage.Client(credentials=_load_credentials())
+    return storage_client
+
+def get_video_client():
+    """Return the Video Intelligence client, creating it with the service account credentials if needed"""
+    global video_client
+    if video_client is None:
+        video_client = videointelligence.VideoIntelligenceServiceClient(credentials=_load_credentials())
+    return video_client
+
+def set_clients(storage=None, video=None):
+    """Use different client backends (e.g. fakes from fake_backends) for storage and/or video analysis"""
+    global storage_client, video_client
+    if storage is not None:
+        storage_client = storage
+        with bucket_handles_lock:
+            bucket_handles.clear()
+    if video is not None:
+        video_client = video
+
+def get_bucket_handle(bucket_name):
+    """Return a bucket handle, fetching the bucket only on first use"""
+    with bucket_handles_lock:
+        bucket = bucket_handles.get(bucket_name)
+    if bucket is None:
+        bucket = cloud_storage_scheduler.call(get_storage_client().get_bucket, bucket_name)
+        with bucket_handles_lock:
+            bucket_handles[bucket_name] = bucket
+    return bucket
+
+def iter_bucket_blobs(bucket_name, prefix=None, page_size=1000):
+    """Yield the blobs in a bucket one page at a time instead of listing them all up front"""
+    bucket = get_bucket_handle(bucket_name)
+    page_token = None
+    while True:
+        def fetch_page():
+            # Each page is a separate request, so a failed page can be retried from its token
+            iterator = bucket.list_blobs(prefix=prefix, page_size=page_size, page_token=page_token)
+            page = next(iterator.pages, None)
+            return (list(page) if page is not None else []), iterator.next_page_token
+
+        blobs, page_token = cloud_storage_scheduler.call(fetch_page)
+        yield from blobs
+        if not page_token:
+            break
+
+def annotate_video(bucket_name, blob_name, features):
+    """Annotate one video in the bucket and return its label, explicit content and shot results"""
+    input_uri = "gs://{}/{}".format(bucket_name, blob_name)
+
+    def run_annotation():
+        # Submitting and waiting are retried together, since a failed operation has to be resubmitted
+        operation = get_video_client().annotate_video(
+            request={
+                "features": features,
+                "input_uri": input_uri,
+            }
+        )
+        print("\nProcessing video {} for label annotations:".format(blob_name))
+        return operation.result(timeout=180)
+
+    with span('annotate_video', video=blob_name):
+        result = video_intelligence_scheduler.call(run_annotation)
+    print("Finished processing video {}.".format(blob_name))
+
+    label_results = []
+    explicit_results = []
+    shot_results = []
+
+    # Label detection
+    segment_labels = result.annotation_results[0].segment_label_annotations
+    for segment_label in segment_labels:
+        label_description = segment_label.entity.description
+        for category_entity in segment_label.category_entities:
+            category_description = category_entity.description
+
+            for segment in segment_label.segments:
+                start_time = segment.segment.start_time_offset.seconds + segment.segment.start_time_offset.microseconds / 1e6
+                end_time = segment.segment.end_time_offset.seconds + segment.segment.end_time_offset.microseconds / 1e6
+                confidence = segment.confidence
+
+                # Append the results to the label results list
+                label_results.append({
+                    "Video": blob_name,
+                    "Label Description": label_description,
+                    "Category Description": category_description,
+                    "Start Time": start_time,
+                    "End Time": end_time,
+                    "Confidence": confidence
+                })
 
-def analyze_videos_in_bucket(bucket_name):
+    # Explicit content detection
+    explicit_content = result.annotation_results[0].explicit_annotation
+    video_confidences = []  # List to store confidences for each video
+    for frame in explicit_content.frames:
+        time_offset = frame.time_offset.seconds + frame.time_offset.microseconds / 1e6
+        pornography_likelihood = frame.pornography_likelihood
+
+        # Append the results to the explicit content results list
+        explicit_results.append({
+            "Video": blob_name,
+            "Label Description": "Explicit Content",
+            "Category Description": "N/A",
+            "Start Time": time_offset,
+            "End Time": time_offset,
+            "Confidence": pornography_likelihood
+        })
+
+        # Append the confidence to the video_confidences list
+        video_confidences.append(pornography_likelihood)
+
+    # Calculate the mean confidence for the video
+    video_mean_confidence = sum(video_confidences) / len(video_confidences) if video_confidences else 0
+
+    # Append the mean confidence to the explicit content results for the video
+    explicit_results.append({
+        "Video": blob_name,
+        "Label Description": "Mean Confidence",
+        "Category Description": "N/A",
+        "Start Time": None,
+        "End Time": None,
+        "Confidence": video_mean_confidence
+    })
+
+    # Shot change detection
+    shot_annotations = result.annotation_results[0].shot_annotations
+    for shot in shot_annotations:
+        start_time = shot.start_time_offset.seconds + shot.start_time_offset.microseconds / 1e6
+        end_time = shot.end_time_offset.seconds + shot.end_time_offset.microseconds / 1e6
+
+        # Append the results to the shot detection results list
+        shot_results.append({
+            "Video": blob_name,
+            "Label Description": "Shot Change",
+            "Category Description": "N/A",
+            "Start Time": start_time,
+            "End Time": end_time,
+            "Confidence": None  # No confidence value for shot change detection
+        })
+
+    return label_results, explicit_results, shot_results
+
+def save_results_to_excel(label_results, explicit_results, shot_results,
+                          excel_file="GoogleVideoIntelligenceLabelAnalyzer_results.xlsx"):
+    """Write the label, explicit content and shot detection tables to an Excel workbook"""
+    # Create DataFrames from the results
+    label_df = pd.DataFrame(label_results)
+    explicit_df = pd.DataFrame(explicit_results)
+    shot_df = pd.DataFrame(shot_results)
+
+    # Create an Excel workbook
+    workbook = Workbook()
+
+    # Create sheets for each table
+    label_sheet = workbook.active
+    label_sheet.title = "Label Detection"
+    explicit_sheet = workbook.create_sheet(title="Explicit Content Detection")
+    shot_sheet = workbook.create_sheet(title="Shot Detection")
+
+    # Write tables to the respective sheets
+    for row in dataframe_to_rows(label_df, index=False, header=True):
+        label_sheet.append(row)
+
+    for row in dataframe_to_rows(explicit_df, index=False, header=True):
+        explicit_sheet.append(row)
+
+    for row in dataframe_to_rows(shot_df, index=False, header=True):
+        shot_sheet.append(row)
+
+    # Apply formatting to the tables
+    header_font = Font(bold=True)
+    alignment = Alignment(horizontal="center", vertical="center")
+
+    for cell in label_sheet[1]:
+        cell.font = header_font
+        cell.alignment = alignment
+
+    for cell in explicit_sheet[1]:
+        cell.font = header_font
+        cell.alignment = alignment
+
+    for cell in shot_sheet[1]:
+        cell.font = header_font
+        cell.alignment = alignment
+
+    # Save the Excel file
+    workbook.save(excel_file)
+    print("Results saved to {}".format(excel_file))
+
+    return excel_file
+
+def analyze_videos_in_bucket(bucket_name, checkpoint_path=None):
     """Analyze videos in the bucket and return the output file path"""
     try:
-        # Use the global video_client that already has credentials
-        global video_client, storage_client
-
         features = [
             videointelligence.Feature.LABEL_DETECTION,
             videointelligence.Feature.SHOT_CHANGE_DETECTION,
@@ -34,151 +250,56 @@ def analyze_videos_in_bucket(bucket_name):
         ]
 
         # Get the list of objects in the bucket
-        # Use global storage_client with credentials
-        bucket = storage_client.get_bucket(bucket_name)
-        blobs = bucket.list_blobs()
-
-        # Create empty lists to store the results
-        label_results = []
-        explicit_results = []
-        shot_results = []
-
-        video_count = 0
-        for blob in blobs:
-            if blob.name.endswith('.mp4'):
-                video_count += 1
-                input_uri = "gs://{}/{}".format(bucket_name, blob.name)
-                operation = video_client.annotate_video(
-                    request={
-                        "features": features,
-                        "input_uri": input_uri,
-                    }
-                )
-                print("\nProcessing video {} for label annotations:".format(blob.name))
-
-                result = operation.result(timeout=180)
-                print("Finished processing video {}.".format(blob.name))
-
-                # Label detection
-                segment_labels = result.annotation_results[0].segment_label_annotations
-                for segment_label in segment_labels:
-                    label_description = segment_label.entity.description
-                    for category_entity in segment_label.category_entities:
-                        category_description = category_entity.description
-
-                        for segment in segment_label.segments:
-                            start_time = segment.segment.start_time_offset.seconds + segment.segment.start_time_offset.microseconds / 1e6
-                            end_time = segment.segment.end_time_offset.seconds + segment.segment.end_time_offset.microseconds / 1e6
-                            confidence = segment.confidence
-
-                            # Append the results to the label results list
-                            label_results.append({
-                                "Video": blob.name,
-                                "Label Description": label_description,
-                                "Category Description": category_description,
-                                "Start Time": start_time,
-                                "End Time": end_time,
-                                "Confidence": confidence
-                            })
-
-                # Explicit content detection
-                explicit_content = result.annotation_results[0].explicit_annotation
-                video_confidences = []  # List to store confidences for each video
-                for frame in explicit_content.frames:
-                    time_offset = frame.time_offset.seconds + frame.time_offset.microseconds / 1e6
-                    pornography_likelihood = frame.pornography_likelihood
-
-                    # Append the results to the explicit content results list
-                    explicit_results.append({
-                        "Video": blob.name,
-                        "Label Description": "Explicit Content",
-                        "Category Description": "N/A",
-                        "Start Time": time_offset,
-                        "End Time": time_offset,
-                        "Confidence": pornography_likelihood
-                    })
-
-                    # Append the confidence to the video_confidences list
-                    video_confidences.append(pornography_likelihood)
-
-                # Calculate the mean confidence for the video
-                video_mean_confidence = sum(video_confidences) / len(video_confidences) if video_confidences else 0
-
-                # Append the mean confidence to the explicit content results for the video
-                explicit_results.append({
-                    "Video": blob.name,
-                    "Label Description": "Mean Confidence",
-                    "Category Description": "N/A",
-                    "Start Time": None,
-                    "End Time": None,
-                    "Confidence": video_mean_confidence
-                })
+        video_names = [blob.name for blob in iter_bucket_blobs(bucket_name) if blob.name.endswith('.mp4')]
 
-                # Shot change detection
-                shot_annotations = result.annotation_results[0].shot_annotations
-                for shot in shot_annotations:
-                    start_time = shot.start_time_offset.seconds + shot.start_time_offset.microseconds / 1e6
-                    end_time = shot.end_time_offset.seconds + shot.end_time_offset.microseconds / 1e6
-
-                    # Append the results to the shot detection results list
-                    shot_results.append({
-                        "Video": blob.name,
-                        "Label Description": "Shot Change",
-                        "Category Description": "N/A",
-                        "Start Time": start_time,
-                        "End Time": end_time,
-                        "Confidence": None  # No confidence value for shot change detection
-                    })
-
-        if video_count == 0:
+        if not video_names:
             print("No videos found in the bucket.")
             return None
 
-        # Create DataFrames from the results
-        label_df = pd.DataFrame(label_results)
-        explicit_df = pd.DataFrame(explicit_results)
-        shot_df = pd.DataFrame(shot_results)
-
-        # Create an Excel workbook
-        workbook = Workbook()
-
-        # Create sheets for each table
-        label_sheet = workbook.active
-        label_sheet.title = "Label Detection"
-        explicit_sheet = workbook.create_sheet(title="Explicit Content Detection")
-        shot_sheet = workbook.create_sheet(title="Shot Detection")
-
-        # Write tables to the respective sheets
-        for row in dataframe_to_rows(label_df, index=False, header=True):
-            label_sheet.append(row)
-
-        for row in dataframe_to_rows(explicit_df, index=False, header=True):
-            explicit_sheet.append(row)
-
-        for row in dataframe_to_rows(shot_df, index=False, header=True):
-            shot_sheet.append(row)
-
-        # Apply formatting to the tables
-        header_font = Font(bold=True)
-        alignment = Alignment(horizontal="center", vertical="center")
-
-        for cell in label_sheet[1]:
-            cell.font = header_font
-            cell.alignment = alignment
-
-        for cell in explicit_sheet[1]:
-            cell.font = header_font
-            cell.alignment = alignment
-
-        for cell in shot_sheet[1]:
-            cell.font = header_font
-            cell.alignment = alignment
-
-        # Save the Excel file
-        excel_file = "GoogleVideoIntelligenceLabelAnalyzer_results.xlsx"
-        workbook.save(excel_file)
-        print("Results saved to {}".format(excel_file))
-        
+        # Results of each video are checkpointed as soon as it finishes, so a restarted run
+        # only analyzes the videos that weren't completed
+        checkpoint = IngestionCheckpoint(checkpoint_path or default_checkpoint_path('videos', bucket_name))
+        completed = {record['name']: record for record in checkpoint.get('video')}
+        pending = [name for name in video_names if name not in completed]
+        if completed:
+            print(f"Skipping {len(video_names) - len(pending)} videos already analyzed")
+
+        def analyze_and_checkpoint(name):
+            labels, explicit, shots = annotate_video(bucket_name, name, features)
+            checkpoint.append('video', name=name, labels=labels, explicit=explicit, shots=shots)
+            return {'name': name, 'labels': labels, 'explicit': explicit, 'shots': shots}
+
+        # Annotate videos concurrently; the shared scheduler caps in-flight operations and request rate
+        failed_videos = []
+        with ThreadPoolExecutor(max_workers=video_intelligence_scheduler.max_concurrency) as executor:
+            analyze = in_current_context(analyze_and_checkpoint)
+            futures = {name: executor.submit(analyze, name) for name in pending}
+            for name, future in futures.items():
+                try:
+                    completed[name] = future.result()
+                except Exception as e:
+                    # One bad video shouldn't throw away the results of the others
+                    print(f"Error analyzing video {name}: {e}")
+                    failed_videos.append(name)
+
+        # Combine the results in bucket order
+        label_results = []
+        explicit_results = []
+        shot_results = []
+        for name in video_names:
+            if name in completed:
+                label_results.extend(completed[name]['labels'])
+                explicit_results.extend(completed[name]['explicit'])
+                shot_results.extend(completed[name]['shots'])
+
+        if failed_videos:
+            print(f"Failed to analyze {len(failed_videos)} of {len(video_names)} videos: {', '.join(failed_videos)}")
+        if len(failed_videos) == len(video_names):
+            raise RuntimeError("All videos in the bucket failed to analyze")
+
+        excel_file = save_results_to_excel(label_results, explicit_results, shot_results)
+        if not failed_videos:
+            checkpoint.complete()
         return excel_file
     except Exception as e:
         print(f"Error analyzing videos: {e}")
@@ -186,15 +307,15 @@ def analyze_videos_in_bucket(bucket_name):
 
 def list_videos_in_bucket(bucket_name):
     try:
-        bucket = storage_client.get_bucket(bucket_name)
-        blobs = list(bucket.list_blobs())
-        
-        video_files = [blob.name for blob in blobs if blob.name.lower().endswith(('.mp4', '.mov', '.avi'))]
+        # Stream the listing page by page and print videos as they are found
+        video_count = 0
+        for blob in iter_bucket_blobs(bucket_name):
+            if blob.name.lower().endswith(VIDEO_EXTENSIONS):
+                video_count += 1
+                print(f"- {blob.name}")
         
-        if video_files:
-            print(f"Found {len(video_files)} videos in bucket '{bucket_name}':")
-            for video in video_files:
-                print(f"- {video}")
+        if video_count:
+            print(f"Found {video_count} videos in bucket '{bucket_name}'.")
             return True
         else:
             print(f"No videos found in bucket '{bucket_name}'.")
@@ -205,12 +326,12 @@ def list_videos_in_bucket(bucket_name):
 
 def create_bucket_if_not_exists(bucket_name):
     try:
-        storage_client.get_bucket(bucket_name)
+        get_bucket_handle(bucket_name)
         print(f"Bucket '{bucket_name}' already exists.")
         return True
     except Exception:
         try:
-            bucket = storage_client.create_bucket(bucket_name)
+            bucket = cloud_storage_scheduler.call(get_storage_client().create_bucket, bucket_name)
             print(f"Bucket '{bucket_name}' created successfully.")
             return True
         except Exception as e:
@@ -223,11 +344,11 @@ def upload_video_to_bucket(bucket_name, source_file_path, destination_blob_name=
         destination_blob_name = os.path.basename(source_file_path)
     
     try:
-        bucket = storage_client.get_bucket(bucket_name)
+        bucket = get_bucket_handle(bucket_name)
         blob = bucket.blob(destination_blob_name)
         
         # Upload the file
-        blob.upload_from_filename(source_file_path)
+        cloud_storage_scheduler.call(blob.upload_from_filename, source_file_path)
         
         print(f"File {source_file_path} uploaded to {destination_blob_name} in bucket {bucket_name}.")
         return True
@@ -235,6 +356,63 @@ def upload_video_to_bucket(bucket_name, source_file_path, destination_blob_name=
         print(f"Error uploading file to bucket: {e}")
         return False
 
+def local_file_md5(file_path):
+    """Return the base64-encoded MD5 of a local file, in the same format as Blob.md5_hash"""
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return base64.b64encode(md5.digest()).decode('ascii')
+
+def upload_file_if_changed(bucket, source_file_path, destination_blob_name, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Upload a file unless the bucket already has an identical copy; returns 'uploaded' or 'skipped'"""
+    existing = cloud_storage_scheduler.call(bucket.get_blob, destination_blob_name)
+    if existing is not None and existing.md5_hash == local_file_md5(source_file_path):
+        return 'skipped'
+
+    # Setting a chunk size makes the client use a resumable upload sent in chunks,
+    # so a dropped connection only resends the current chunk
+    blob = bucket.blob(destination_blob_name, chunk_size=chunk_size)
+    cloud_storage_scheduler.call(blob.upload_from_filename, source_file_path)
+    return 'uploaded'
+
+def bulk_upload_directory(bucket_name, directory, prefix='', max_workers=8, chunk_size=UPLOAD_CHUNK_SIZE,
+                          extensions=VIDEO_EXTENSIONS):
+    """Upload all videos in a local directory to the bucket in parallel, skipping unchanged files"""
+    bucket = get_bucket_handle(bucket_name)
+
+    files = []
+    for root, _, file_names in os.walk(directory):
+        for file_name in sorted(file_names):
+            if file_name.lower().endswith(extensions):
+                source_file_path = os.path.join(root, file_name)
+                relative_path = os.path.relpath(source_file_path, directory).replace(os.sep, '/')
+                files.append((source_file_path, prefix + relative_path))
+
+    if not files:
+        print(f"No videos found in '{directory}'.")
+        return {'uploaded': [], 'skipped': [], 'failed': []}
+
+    print(f"Uploading {len(files)} videos from '{directory}' to bucket '{bucket_name}'...")
+    summary = {'uploaded': [], 'skipped': [], 'failed': []}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        upload = in_current_context(upload_file_if_changed)
+        futures = {executor.submit(upload, bucket, source, name, chunk_size): name
+                   for source, name in files}
+        for future, name in futures.items():
+            try:
+                status = future.result()
+            except Exception as e:
+                print(f"Error uploading {name}: {e}")
+                summary['failed'].append(name)
+                continue
+            summary[status].append(name)
+            print(f"{status.capitalize()}: {name}")
+
+    print(f"Uploaded {len(summary['uploaded'])}, skipped {len(summary['skipped'])} unchanged, "
+          f"failed {len(summary['failed'])}.")
+    return summary
+
 if __name__ == "__main__":
     # Specify your bucket name
     bucket_name = "anime_food_landscape_object_bucket"
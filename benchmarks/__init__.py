@@ -0,0 +1 @@
+"""Benchmarks for the music emotion pipeline, run with synthetic data generated by benchmarks.generators."""
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+# Characters used by Spotify base62 IDs
+BASE62 = np.array(list('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'))
+
+# Label and category vocabularies, including terms that map_video_content_to_emotions recognises
+VIDEO_LABELS = [
+    'dance', 'music', 'performance', 'concert', 'singing', 'party', 'fun', 'smile',
+    'nature', 'water', 'sky', 'fight', 'explosion', 'romance', 'love', 'food',
+    'sports', 'game', 'cry', 'night', 'sunset', 'anime', 'illustration', 'flame',
+    'car', 'city', 'beach', 'crowd', 'stage', 'cooking'
+]
+VIDEO_CATEGORIES = [
+    'Entertainment', 'Sports', 'Art', 'Nature', 'Action', 'Drama', 'Comedy',
+    'Adventure', 'Romance', 'Music', 'Event', 'Food', 'Vehicle', 'Person'
+]
+
+def generate_ids(rng, n, length=22):
+    """Generate n random base62 IDs of the given length"""
+    chars = BASE62[rng.integers(0, len(BASE62), size=(n, length))]
+    return np.ascontiguousarray(chars).view(f'<U{length}').ravel()
+
+def generate_catalog(n_tracks, seed=0, tracks_per_artist=10, tracks_per_album=8):
+    """Generate a synthetic track catalog with the same columns as fetch_spotify_metadata"""
+    rng = np.random.default_rng(seed)
+    n_artists = max(n_tracks // tracks_per_artist, 1)
+    n_albums = max(n_tracks // tracks_per_album, 1)
+
+    artist_codes = rng.integers(0, n_artists, size=n_tracks)
+    album_codes = rng.integers(0, n_albums, size=n_tracks)
+
+    # Build names from small pools of unique strings so generation stays fast at 10M rows
+    artist_names = np.char.add('Artist ', np.arange(n_artists).astype(str))
+    album_names = np.char.add('Album ', np.arange(n_albums).astype(str))
+    track_names = np.char.add('Track ', np.arange(n_tracks).astype(str))
+
+    # Release dates between 1960 and 2025 in Spotify's YYYY-MM-DD format
+    release_days = rng.integers(0, 66 * 365, size=n_tracks)
+    release_dates = (np.datetime64('1960-01-01') + release_days.astype('timedelta64[D]')).astype(str)
+
+    return pd.DataFrame({
+        'track_id': generate_ids(rng, n_tracks),
+        'track_name': track_names,
+        'artist': artist_names[artist_codes],
+        'album_name': album_names[album_codes],
+        'release_date': release_dates,
+        'duration_ms': rng.normal(200000, 45000, size=n_tracks).clip(30000, 900000).astype(np.int64),
+        'popularity': rng.integers(0, 101, size=n_tracks),
+        'explicit': rng.random(n_tracks) < 0.15,
+        'preview_url': ''
+    })
+
+def generate_audio_features(n_tracks, seed=0, catalog=None):
+    """Generate synthetic audio features with the same columns as MusicEmotionClassifier.preprocess_data"""
+    rng = np.random.default_rng(seed)
+    features = pd.DataFrame({
+        'danceability': rng.uniform(0, 1, n_tracks),
+        'energy': rng.uniform(0, 1, n_tracks),
+        'key': rng.integers(0, 12, n_tracks),
+        'loudness': rng.uniform(-60, 0, n_tracks),
+        'mode': rng.integers(0, 2, n_tracks),
+        'speechiness': rng.uniform(0, 1, n_tracks),
+        'acousticness': rng.uniform(0, 1, n_tracks),
+        'instrumentalness': rng.uniform(0, 1, n_tracks),
+        'liveness': rng.uniform(0, 1, n_tracks),
+        'valence': rng.uniform(0, 1, n_tracks),
+        'tempo': rng.uniform(50, 200, n_tracks),
+        'duration_ms': catalog['duration_ms'].values if catalog is not None else rng.integers(30000, 900000, n_tracks),
+        'popularity': catalog['popularity'].values if catalog is not None else rng.integers(0, 101, n_tracks)
+    })
+    return features
+
+def generate_annotations(n_videos, segments_per_video=50, shots_per_video=40, frames_per_video=30,
+                         video_length=60.0, seed=0):
+    """Generate synthetic video annotation tables matching the analyze_videos_in_bucket sheets"""
+    rng = np.random.default_rng(seed)
+    video_names = np.char.add(np.char.add('video_', np.arange(n_videos).astype(str)), '.mp4')
+
+    # Label Detection: random labels over random segments of each video
+    n_labels = n_videos * segments_per_video
+    starts = rng.uniform(0, video_length, n_labels)
+    label_df = pd.DataFrame({
+        'Video': np.repeat(video_names, segments_per_video),
+        'Label Description': np.array(VIDEO_LABELS)[rng.integers(0, len(VIDEO_LABELS), n_labels)],
+        'Category Description': np.array(VIDEO_CATEGORIES)[rng.integers(0, len(VIDEO_CATEGORIES), n_labels)],
+        'Start Time': starts,
+        'End Time': np.minimum(starts + rng.uniform(0.5, 10, n_labels), video_length),
+        'Confidence': rng.uniform(0.3, 1.0, n_labels)
+    })
+
+    # Explicit Content Detection: evenly spaced frames with a likelihood from 1 (very unlikely) to 5
+    n_frames = n_videos * frames_per_video
+    frame_times = np.tile(np.linspace(0, video_length, frames_per_video, endpoint=False), n_videos)
+    likelihoods = rng.choice([1, 2, 3, 4, 5], size=n_frames, p=[0.7, 0.2, 0.06, 0.03, 0.01])
+    explicit_df = pd.DataFrame({
+        'Video': np.repeat(video_names, frames_per_video),
+        'Label Description': 'Explicit Content',
+        'Category Description': 'N/A',
+        'Start Time': frame_times,
+        'End Time': frame_times,
+        'Confidence': likelihoods
+    })
+    mean_df = pd.DataFrame({
+        'Video': video_names,
+        'Label Description': 'Mean Confidence',
+        'Category Description': 'N/A',
+        'Start Time': None,
+        'End Time': None,
+        'Confidence': likelihoods.reshape(n_videos, frames_per_video).mean(axis=1)
+    })
+    explicit_df = pd.concat([explicit_df, mean_df], ignore_index=True)
+
+    # Shot Detection: contiguous shots whose boundaries are random cut points in each video
+    cuts = np.sort(rng.uniform(0, video_length, (n_videos, shots_per_video - 1)), axis=1)
+    boundaries = np.hstack([np.zeros((n_videos, 1)), cuts, np.full((n_videos, 1), video_length)])
+    shot_df = pd.DataFrame({
+        'Video': np.repeat(video_names, shots_per_video),
+        'Label Description': 'Shot Change',
+        'Category Description': 'N/A',
+        'Start Time': boundaries[:, :-1].ravel(),
+        'End Time': boundaries[:, 1:].ravel(),
+        'Confidence': None
+    })
+
+    return {
+        'Label Detection': label_df,
+        'Explicit Content Detection': explicit_df,
+        'Shot Detection': shot_df
+    }
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""Run the benchmark suite against synthetic data and store the results for comparison.
+
+Run from the repository root, e.g.:
+    python -m benchmarks.run_benchmarks --tracks 10000 100000 --videos 100
+    python -m benchmarks.run_benchmarks --tracks 1000000 --only predict score --compare
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.generators import generate_catalog, generate_audio_features, generate_annotations
+from instrumentation import get_peak_rss
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.jsonl')
+
+# Excel sheets cannot hold more than this many rows
+EXCEL_MAX_ROWS = 1048575
+
+def time_call(func, repeat=3):
+    """Run func repeatedly and return the best wall time and the last result"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        # Silence the per-track prints and Keras progress bars while timing
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def bench_preprocess(ctx):
+    from AutoLabel import MusicEmotionClassifier
+    classifier = MusicEmotionClassifier()
+    return time_call(lambda: classifier.preprocess_data(ctx['catalog']), ctx['repeat'])[0]
+
+def bench_labelling(ctx):
+    from AutoLabel import MusicEmotionClassifier
+    classifier = MusicEmotionClassifier()
+    return time_call(lambda: classifier._assign_initial_emotions(ctx['features']), ctx['repeat'])[0]
+
+def bench_train_epoch(ctx):
+    from AutoLabel import MusicEmotionClassifier
+    classifier = MusicEmotionClassifier()
+    labels = classifier._assign_initial_emotions(ctx['features'])
+    # Build the model once so that only the epoch itself is timed
+    with contextlib.redirect_stdout(io.StringIO()):
+        classifier.train(ctx['features'], labels, epochs=1)
+    ctx['classifier'] = classifier
+    return time_call(lambda: classifier.train(ctx['features'], labels, epochs=1), ctx['repeat'])[0]
+
+def bench_predict(ctx):
+    classifier = ctx.get('classifier')
+    if classifier is None:
+        train_ctx = dict(ctx, repeat=1)
+        bench_train_epoch(train_ctx)
+        classifier = ctx['classifier'] = train_ctx['classifier']
+    elapsed, (_, emotion_probabilities) = time_call(lambda: classifier.predict_emotion(ctx['features']), ctx['repeat'])
+    ctx['emotion_probabilities'] = emotion_probabilities
+    return elapsed
+
+def bench_video_labels(ctx):
+    from main import video_emotion_distribution
+    label_df = ctx['annotations']['Label Detection']
+
+    def run():
+        label_counts = label_df['Label Description'].value_counts()
+        category_counts = label_df['Category Description'].value_counts()
+        return video_emotion_distribution(label_counts.head(5), category_counts.head(5))
+    return time_call(run, ctx['repeat'])[0]
+
+def bench_score(ctx):
+    import numpy as np
+    from main import score_tracks
+    emotion_probabilities = ctx.get('emotion_probabilities')
+    if emotion_probabilities is None:
+        emotion_probabilities = np.random.default_rng(0).random((len(ctx['catalog']), 5), dtype=np.float32)
+    video_emotions = np.array([0.4, 0.0, 0.4, 0.2, 0.0])
+    video_df = ctx['annotations']['Label Detection']
+    return time_call(lambda: score_tracks(emotion_probabilities, video_emotions, ctx['catalog'],
+                                          ctx['features'], video_df), ctx['repeat'])[0]
+
+def bench_filter(ctx):
+    from catalog_filters import add_filter_columns, build_filter_mask
+    catalog = add_filter_columns(ctx['catalog'])
+    return time_call(lambda: build_filter_mask(catalog, allow_explicit=False, popularity_bands=['high', 'top'],
+                                               duration_bands=['medium', 'long'], min_year=1990),
+                     ctx['repeat'])[0]
+
+def bench_rerank(ctx):
+    import numpy as np
+    from reranking import mmr_rerank, SIMILARITY_FEATURES
+    catalog = ctx['catalog']
+    relevance = 100 + catalog['popularity'].clip(upper=30).to_numpy(dtype=float)
+    features = ctx['features'][SIMILARITY_FEATURES].to_numpy()
+    artists = catalog['artist'].to_numpy()
+    timings = {'seconds': time_call(lambda: mmr_rerank(relevance, features, artists, k=100), ctx['repeat'])[0]}
+
+    # Top 20 * k tracks from two artists, so the artist cap forces the candidate pool to be refilled
+    clustered = artists.copy()
+    top = np.argsort(-relevance)[:200]
+    clustered[top] = np.asarray(artists[top[:2]])[np.arange(200) % 2]
+    timings['clustered_seconds'] = time_call(lambda: mmr_rerank(relevance, features, clustered, k=10),
+                                             ctx['repeat'])[0]
+    return timings
+
+def bench_storage(ctx):
+    import pandas as pd
+    catalog = ctx['catalog']
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        formats = [('csv', catalog.to_csv, pd.read_csv, {'index': False})]
+        if len(catalog) <= EXCEL_MAX_ROWS:
+            formats.append(('xlsx', catalog.to_excel, pd.read_excel, {'index': False}))
+        try:
+            import pyarrow  # noqa: F401
+            formats.append(('parquet', catalog.to_parquet, pd.read_parquet, {'index': False}))
+        except ImportError:
+            print("pyarrow not installed, skipping parquet storage benchmark")
+
+        for extension, writer, reader, kwargs in formats:
+            path = os.path.join(tmp_dir, f'catalog.{extension}')
+            timings[f'write_{extension}'] = time_call(lambda: writer(path, **kwargs), ctx['repeat'])[0]
+            timings[f'read_{extension}'] = time_call(lambda: reader(path), ctx['repeat'])[0]
+            timings[f'{extension}_bytes'] = os.path.getsize(path)
+    return timings
+
+def bench_catalog(ctx):
+    from compact_catalog import CompactCatalog
+    catalog = ctx['catalog']
+    build_time, compact = time_call(lambda: CompactCatalog.from_frame(catalog), ctx['repeat'])
+    timings = {
+        'build_seconds': build_time,
+        'dataframe_bytes': int(catalog.memory_usage(deep=True).sum()),
+        'compact_bytes': compact.nbytes
+    }
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'catalog.parquet')
+            timings['write_parquet'] = time_call(lambda: compact.save_parquet(path), ctx['repeat'])[0]
+            timings['read_parquet'] = time_call(lambda: CompactCatalog.load_parquet(path), ctx['repeat'])[0]
+    except ImportError as e:
+        print(f"Skipping compact catalog Parquet benchmark: {e}")
+    return timings
+
+BENCHMARKS = {
+    'preprocess': bench_preprocess,
+    'labelling': bench_labelling,
+    'train_epoch': bench_train_epoch,
+    'predict': bench_predict,
+    'video_labels': bench_video_labels,
+    'filter': bench_filter,
+    'score': bench_score,
+    'rerank': bench_rerank,
+    'storage': bench_storage,
+    'catalog': bench_catalog,
+}
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+def load_results(results_file=RESULTS_FILE):
+    """Load all stored benchmark results"""
+    if not os.path.exists(results_file):
+        return []
+    with open(results_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def save_results(results, results_file=RESULTS_FILE):
+    """Append benchmark results to the results file"""
+    with open(results_file, 'a') as f:
+        for result in results:
+            f.write(json.dumps(result) + '\n')
+    print(f"Benchmark results appended to {results_file}")
+
+def result_key(result):
+    return (result['benchmark'], result['metric'], json.dumps(result['params'], sort_keys=True))
+
+def compare_results(results, previous_results, threshold=0.2):
+    """Compare results with the most recent earlier run of the same benchmark and parameters"""
+    baseline = {}
+    for previous in previous_results:
+        baseline[result_key(previous)] = previous
+
+    regressions = []
+    print("\nComparison with previous run:")
+    for result in results:
+        previous = baseline.get(result_key(result))
+        if previous is None or not previous['value'] or result['metric'].endswith('_bytes'):
+            continue
+        change = (result['value'] - previous['value']) / previous['value']
+        flag = ''
+        if change > threshold:
+            flag = '  <-- REGRESSION'
+            regressions.append(result)
+        print(f"{result['benchmark']:<14}{result['metric']:<16}{result['params']['tracks']:>10} tracks "
+              f"{previous['value']:>10.4f}s -> {result['value']:>10.4f}s ({change:+.1%}){flag}")
+    return regressions
+
+def run_suite(track_counts, n_videos, segments_per_video, only=None, repeat=3, seed=0):
+    """Run the selected benchmarks at each catalog size and return the result records"""
+    run_id = datetime.now().isoformat(timespec='seconds')
+    commit = get_git_commit()
+    results = []
+    names = only or list(BENCHMARKS)
+
+    annotations = generate_annotations(n_videos, segments_per_video, seed=seed)
+    for n_tracks in track_counts:
+        print(f"\nGenerating synthetic catalog with {n_tracks} tracks...")
+        catalog = generate_catalog(n_tracks, seed=seed)
+        ctx = {
+            'catalog': catalog,
+            'features': generate_audio_features(n_tracks, seed=seed, catalog=catalog),
+            'annotations': annotations,
+            'repeat': repeat,
+        }
+        params = {'tracks': n_tracks, 'videos': n_videos, 'segments': segments_per_video, 'seed': seed}
+
+        for name in names:
+            try:
+                timing = BENCHMARKS[name](ctx)
+            except Exception as e:
+                print(f"Skipping {name}: {type(e).__name__}: {e}")
+                continue
+            metrics = timing if isinstance(timing, dict) else {'seconds': timing}
+            for metric, value in metrics.items():
+                print(f"{name:<14}{metric:<16}{n_tracks:>10} tracks: {value:.4f}")
+                results.append({
+                    'run_id': run_id,
+                    'commit': commit,
+                    'python': platform.python_version(),
+                    'machine': platform.machine(),
+                    'benchmark': name,
+                    'metric': metric,
+                    'value': value,
+                    'params': params,
+                    'peak_rss_bytes': get_peak_rss()
+                })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the music emotion pipeline on synthetic data')
+    parser.add_argument('--tracks', type=int, nargs='+', default=[10000], help='Catalog sizes to benchmark')
+    parser.add_argument('--videos', type=int, default=100, help='Number of synthetic videos')
+    parser.add_argument('--segments', type=int, default=50, help='Label segments per synthetic video')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='Only run these benchmarks')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions per benchmark (best time is kept)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic data')
+    parser.add_argument('--results-file', type=str, default=RESULTS_FILE, help='JSON lines file to store results in')
+    parser.add_argument('--compare', action='store_true', help='Compare with the previous stored run')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Slowdown fraction reported as a regression')
+    args = parser.parse_args()
+
+    previous_results = load_results(args.results_file)
+    results = run_suite(args.tracks, args.videos, args.segments, args.only, args.repeat, args.seed)
+    save_results(results, args.results_file)
+
+    if args.compare:
+        regressions = compare_results(results, previous_results, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
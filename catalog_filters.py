@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+# Band edges; each band is stored as one bit so a set of allowed bands is a single bitmask
+POPULARITY_BANDS = {
+    'low': (0, 25),
+    'medium': (25, 50),
+    'high': (50, 75),
+    'top': (75, 101),
+}
+DURATION_BANDS = {
+    'short': (0, 120000),          # under 2 minutes
+    'medium': (120000, 210000),    # 2 to 3.5 minutes
+    'long': (210000, 300000),      # 3.5 to 5 minutes
+    'extended': (300000, np.inf),  # 5 minutes and over
+}
+
+# Pornography likelihood at or above which a video counts as explicit (3 = POSSIBLE)
+EXPLICIT_VIDEO_LIKELIHOOD = 3
+
+FILTER_COLUMNS = ['is_explicit', 'popularity_band', 'duration_band', 'release_year']
+
+def _band_bits(values, bands):
+    """Return a uint8 column with the bit of the band each value falls in (0 if none)"""
+    values = np.asarray(values, dtype=float)
+    bits = np.zeros(len(values), dtype=np.uint8)
+    for index, (low, high) in enumerate(bands.values()):
+        bits[(values >= low) & (values < high)] = 1 << index
+    return bits
+
+def bands_to_mask(names, bands):
+    """Combine band names into the bitmask of allowed bands"""
+    mask = 0
+    for name in names:
+        if name not in bands:
+            raise ValueError(f"Unknown band '{name}', expected one of: {', '.join(bands)}")
+        mask |= 1 << list(bands).index(name)
+    return mask
+
+def add_filter_columns(df):
+    """Precompute the compact filter columns used to narrow the catalog before scoring"""
+    n = len(df)
+    explicit = df['explicit'] if 'explicit' in df else pd.Series(False, index=df.index)
+    popularity = df['popularity'].fillna(0) if 'popularity' in df else pd.Series(0, index=df.index)
+    duration = df['duration_ms'].fillna(0) if 'duration_ms' in df else pd.Series(0, index=df.index)
+    if 'release_date' in df:
+        # Spotify dates are YYYY, YYYY-MM or YYYY-MM-DD
+        release_year = pd.to_numeric(df['release_date'].astype(str).str[:4], errors='coerce').fillna(0)
+    else:
+        release_year = np.zeros(n)
+
+    df = df.copy()
+    df['is_explicit'] = explicit.fillna(False).astype(bool).to_numpy()
+    df['popularity_band'] = _band_bits(popularity, POPULARITY_BANDS)
+    df['duration_band'] = _band_bits(duration, DURATION_BANDS)
+    df['release_year'] = np.asarray(release_year, dtype=np.int16)
+    return df
+
+def build_filter_mask(df, allow_explicit=True, popularity_bands=None, duration_bands=None,
+                      min_year=None, max_year=None):
+    """Intersect the precomputed filter columns into one boolean mask over the catalog"""
+    if any(column not in df for column in FILTER_COLUMNS):
+        df = add_filter_columns(df)
+
+    mask = np.ones(len(df), dtype=bool)
+    if not allow_explicit:
+        mask &= ~df['is_explicit'].to_numpy()
+    if popularity_bands:
+        mask &= (df['popularity_band'].to_numpy() & bands_to_mask(popularity_bands, POPULARITY_BANDS)) != 0
+    if duration_bands:
+        mask &= (df['duration_band'].to_numpy() & bands_to_mask(duration_bands, DURATION_BANDS)) != 0
+    if min_year is not None or max_year is not None:
+        years = df['release_year'].to_numpy()
+        if min_year is not None:
+            mask &= years >= min_year
+        if max_year is not None:
+            mask &= years <= max_year
+    return mask
+
+def video_is_explicit(explicit_df):
+    """Whether any analyzed video's mean pornography likelihood reaches EXPLICIT_VIDEO_LIKELIHOOD"""
+    if explicit_df is None or explicit_df.empty:
+        return False
+    means = explicit_df.loc[explicit_df['Label Description'] == 'Mean Confidence', 'Confidence']
+    return bool((pd.to_numeric(means, errors='coerce').fillna(0) >= EXPLICIT_VIDEO_LIKELIHOOD).any())
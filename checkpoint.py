@@ -0,0 +1,70 @@
+import json
+import os
+import threading
+
+# Directory for ingestion checkpoints (not committed to git)
+CHECKPOINT_DIR = 'checkpoints'
+
+def default_checkpoint_path(kind, name):
+    """Return the checkpoint path for an ingestion job, e.g. ('spotify', playlist_id)"""
+    safe_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name)
+    return os.path.join(CHECKPOINT_DIR, f'{kind}_{safe_name}.jsonl')
+
+class IngestionCheckpoint:
+    """Append-only JSON lines log of ingestion progress.
+
+    Each record is flushed to disk as soon as it is written, so after a crash or
+    timeout the job can replay the log and carry on from where it stopped.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.records = self._load()
+        if self.records:
+            print(f"Resuming from checkpoint {path} ({len(self.records)} records)")
+
+    def _load(self):
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        good_end = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # A partially written last line from a crash; drop it so new records start on a fresh line
+                    print(f"Ignoring truncated record in checkpoint {self.path}")
+                    break
+                good_end += len(line)
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    print(f"Skipping corrupt record at byte {good_end - len(line)} in checkpoint {self.path}")
+        if good_end < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(good_end)
+        return records
+
+    def append(self, record_type, **data):
+        """Append a record to the log and flush it to disk"""
+        record = dict(data, type=record_type)
+        line = json.dumps(record, default=str)
+        with self.lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.records.append(record)
+
+    def get(self, record_type):
+        """Return all records of the given type in the order they were written"""
+        return [record for record in self.records if record['type'] == record_type]
+
+    def complete(self):
+        """Remove the checkpoint once the job has finished, so the next run starts fresh"""
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.records = []
@@ -0,0 +1,267 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from catalog_filters import add_filter_columns
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # pyarrow is only needed to load and save catalogs as Parquet
+    pa = None
+    pq = None
+
+# How each catalog column is stored; columns not listed are kept as dictionary-encoded strings
+ID_COLUMNS = ['track_id']
+CATEGORICAL_COLUMNS = ['artist', 'album_name', 'release_date', 'preview_url']
+STRING_COLUMNS = ['track_name']
+NUMERIC_DTYPES = {
+    'duration_ms': np.int32,
+    'popularity': np.int32,
+    'is_explicit': np.bool_,
+    'explicit': np.bool_,
+    'popularity_band': np.uint8,
+    'duration_band': np.uint8,
+    'release_year': np.int16,
+}
+
+class SortedIndex:
+    """Maps keys to positions with a sorted copy and binary search, without per-key Python objects"""
+    def __init__(self, keys):
+        self.keys = np.asarray(keys)
+        self.order = np.argsort(self.keys, kind='stable')
+        self.sorted_keys = self.keys[self.order]
+
+    def get_indexer(self, values):
+        """Positions of values in the keys, -1 where a value is missing.
+
+        Values are compared as given, never cast to the keys' fixed width, so a value
+        longer than the keys can't match a key that equals its truncated prefix.
+        """
+        values = np.asarray(values)
+        if {values.dtype.kind, self.keys.dtype.kind} == {'S', 'U'}:
+            raise TypeError(f"Cannot look up {values.dtype} values in {self.keys.dtype} keys; "
+                            f"encode or decode them first")
+        if len(self.keys) == 0:
+            return np.full(len(values), -1)
+        positions = np.minimum(np.searchsorted(self.sorted_keys, values), len(self.keys) - 1)
+        return np.where(self.sorted_keys[positions] == values, self.order[positions], -1)
+
+def _narrow_offsets(offsets):
+    """Use int32 string offsets unless the buffer is too large for them"""
+    return offsets.astype(np.int32) if offsets[-1] < 2 ** 31 else offsets
+
+class StringColumn:
+    """Strings packed into one UTF-8 buffer with offsets into it, decoded only when read"""
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_values(cls, values):
+        encoded = [('' if value is None or value != value else str(value)).encode() for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), _narrow_offsets(offsets))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes
+
+    def decode(self, rows=None):
+        """Decode the strings at rows (all by default) into an object array"""
+        if rows is None:
+            rows = range(len(self))
+        # Copy the whole buffer to bytes once when decoding a large share of the rows
+        buffer = self.data.tobytes() if len(rows) > len(self) // 8 else None
+        values = np.empty(len(rows), dtype=object)
+        for i, row in enumerate(rows):
+            start, end = self.offsets[row], self.offsets[row + 1]
+            values[i] = (buffer[start:end] if buffer is not None else self.data[start:end].tobytes()).decode()
+        return values
+
+    def take(self, rows):
+        """A new column holding the strings at rows, gathered without decoding them"""
+        rows = np.asarray(rows)
+        starts, ends = self.offsets[rows], self.offsets[rows + 1]
+        lengths = ends - starts
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # Byte positions of every selected string, laid out back to back
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return StringColumn(self.data[positions], _narrow_offsets(offsets))
+
+class CompactCatalog:
+    """Memory-compact, column-oriented track catalog.
+
+    Artist, album, release date and preview URL are dictionary-encoded (int32 codes
+    plus one interned copy of each distinct string), track names are packed into a
+    single UTF-8 buffer, track IDs are fixed-width bytes with a binary-search index,
+    and numbers use int32/float32 or smaller. Indexing a column returns a Series over
+    the stored array without copying it, so the catalog can stand in for the
+    DataFrame wherever columns are read.
+    """
+    def __init__(self, columns, length):
+        self.columns = columns
+        self.length = length
+        self._index = None
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build a compact catalog from a metadata DataFrame, adding the filter columns"""
+        df = add_filter_columns(df)
+        columns = {}
+        for name in df.columns:
+            values = df[name]
+            if name in ID_COLUMNS:
+                columns[name] = values.fillna('').astype(str).str.encode('utf-8').to_numpy(dtype=bytes)
+            elif name in NUMERIC_DTYPES:
+                columns[name] = values.fillna(0).to_numpy(dtype=NUMERIC_DTYPES[name])
+            elif name in STRING_COLUMNS:
+                columns[name] = StringColumn.from_values(values)
+            elif pd.api.types.is_float_dtype(values):
+                columns[name] = values.to_numpy(dtype=np.float32)
+            elif pd.api.types.is_integer_dtype(values):
+                columns[name] = values.to_numpy(dtype=np.int32)
+            else:
+                codes, categories = pd.factorize(values.astype(object).where(values.notna(), ''))
+                columns[name] = pd.Categorical.from_codes(
+                    codes.astype(np.int32), [sys.intern(str(category)) for category in categories])
+        return cls(columns, len(df))
+
+    def __len__(self):
+        return self.length
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        """A Series over the stored column; numeric and categorical columns are not copied"""
+        column = self.columns[name]
+        if isinstance(column, StringColumn):
+            return pd.Series(column.decode(), name=name)
+        if column.dtype.kind == 'S':
+            return pd.Series(column.astype(str), name=name)
+        return pd.Series(column, name=name, copy=False)
+
+    @property
+    def track_ids(self):
+        """Track IDs as a fixed-width bytes array (no copy)"""
+        return self.columns['track_id']
+
+    @property
+    def empty(self):
+        return self.length == 0
+
+    def rows_for(self, track_ids):
+        """Row numbers of the given track IDs, -1 for IDs not in the catalog"""
+        if self._index is None:
+            self._index = SortedIndex(self.track_ids)
+        return self._index.get_indexer(np.char.encode(np.asarray(track_ids, dtype=str), 'utf-8'))
+
+    def take(self, rows):
+        """A new catalog with only the given rows; dictionary-encoded columns share their strings"""
+        rows = np.flatnonzero(rows) if np.asarray(rows).dtype == bool else np.asarray(rows)
+        columns = {}
+        for name, column in self.columns.items():
+            if isinstance(column, StringColumn):
+                columns[name] = column.take(rows)
+            elif isinstance(column, pd.Categorical):
+                columns[name] = pd.Categorical.from_codes(column.codes[rows], column.categories)
+            else:
+                columns[name] = column[rows]
+        return CompactCatalog(columns, len(rows))
+
+    def to_frame(self, rows=None, columns=None):
+        """Decode the given rows and columns (all by default) into a regular DataFrame"""
+        rows = np.arange(self.length) if rows is None else np.asarray(rows)
+        data = {}
+        for name in columns or self.columns:
+            column = self.columns[name]
+            if isinstance(column, StringColumn):
+                data[name] = column.decode(rows)
+            elif isinstance(column, pd.Categorical):
+                data[name] = np.asarray(column.categories, dtype=object)[column.codes[rows]]
+            elif column.dtype.kind == 'S':
+                data[name] = column[rows].astype(str)
+            else:
+                data[name] = column[rows]
+        return pd.DataFrame(data)
+
+    @property
+    def nbytes(self):
+        """Approximate resident size of the catalog's data in bytes"""
+        total = 0
+        for column in self.columns.values():
+            if isinstance(column, StringColumn):
+                total += column.nbytes
+            elif isinstance(column, pd.Categorical):
+                total += column.codes.nbytes + sum(sys.getsizeof(category) for category in column.categories)
+            else:
+                total += column.nbytes
+        return total
+
+    def save_parquet(self, path):
+        """Write the catalog to Parquet, keeping the dictionary encoding"""
+        if pa is None:
+            raise ImportError("Saving catalogs as Parquet requires pyarrow (pip install pyarrow)")
+        arrays = {}
+        for name, column in self.columns.items():
+            if isinstance(column, StringColumn):
+                string_array = pa.StringArray if column.offsets.dtype == np.int32 else pa.LargeStringArray
+                arrays[name] = string_array.from_buffers(len(column), pa.py_buffer(column.offsets),
+                                                         pa.py_buffer(column.data))
+            elif isinstance(column, pd.Categorical):
+                arrays[name] = pa.DictionaryArray.from_arrays(pa.array(column.codes),
+                                                              pa.array(list(column.categories), pa.string()))
+            elif column.dtype.kind == 'S':
+                arrays[name] = pa.array(column.astype(str))
+            else:
+                arrays[name] = pa.array(column)
+        pq.write_table(pa.table(arrays), path)
+
+    @classmethod
+    def load_parquet(cls, path):
+        """Load a catalog written by save_parquet"""
+        if pq is None:
+            raise ImportError("Loading catalogs from Parquet requires pyarrow (pip install pyarrow)")
+        table = pq.read_table(path)
+        columns = {}
+        for name in table.column_names:
+            array = table.column(name).combine_chunks()
+            if pa.types.is_dictionary(array.type):
+                categories = [sys.intern(value) for value in array.dictionary.to_pylist()]
+                columns[name] = pd.Categorical.from_codes(array.indices.to_numpy(zero_copy_only=False)
+                                                          .astype(np.int32), categories)
+            elif name in ID_COLUMNS:
+                columns[name] = np.char.encode(np.asarray(array.to_numpy(zero_copy_only=False), dtype=str), 'utf-8')
+            elif pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+                # Reuse Arrow's own UTF-8 buffer and offsets
+                _, offsets_buffer, data_buffer = array.buffers()
+                offset_dtype = np.int64 if pa.types.is_large_string(array.type) else np.int32
+                offsets = np.frombuffer(offsets_buffer, dtype=offset_dtype)[array.offset:array.offset + len(array) + 1]
+                data = np.frombuffer(data_buffer, dtype=np.uint8) if data_buffer is not None else np.zeros(0, np.uint8)
+                columns[name] = StringColumn(data, offsets)
+            else:
+                columns[name] = array.to_numpy(zero_copy_only=False)
+        return cls(columns, table.num_rows)
+
+def load_catalog(path):
+    """Load a track catalog as a CompactCatalog from Parquet, or from Excel/CSV metadata.
+
+    For an Excel or CSV path, a Parquet file with the same name is used instead when
+    it exists and is not older, since it loads much faster.
+    """
+    parquet_path = os.path.splitext(path)[0] + '.parquet'
+    if pq is not None and os.path.exists(parquet_path) and (
+            not os.path.exists(path) or os.path.getmtime(parquet_path) >= os.path.getmtime(path)):
+        return CompactCatalog.load_parquet(parquet_path)
+    if path.endswith('.csv'):
+        return CompactCatalog.from_frame(pd.read_csv(path))
+    return CompactCatalog.from_frame(pd.read_excel(path))
@@ -0,0 +1,468 @@
+"""Local stand-ins for the Spotify Web API and Google Cloud clients.
+
+These let the ingestion path run offline so concurrency, retry and caching
+behaviour can be load-tested deterministically:
+
+    from fake_backends import install_fake_backends
+    backends = install_fake_backends(latency=0.05, error_rate=0.1)
+    ...
+    backends.shutdown()
+"""
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs, urlencode
+
+BASE62 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+# Playlist fetched by main.fetch_spotify_data when no ID is given
+DEFAULT_PLAYLIST_ID = '65LdqYCLcsV0lJoxpeQ6fW'
+
+def _fake_id(rng):
+    return ''.join(rng.choice(BASE62) for _ in range(22))
+
+class FaultInjector:
+    """Decides deterministically whether a request should be delayed or fail.
+
+    The decision for the nth request to a given key only depends on the seed,
+    the key and n, so results don't change with thread scheduling.
+    """
+    def __init__(self, latency=0.0, latency_jitter=0.0, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1, seed=0):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.stats = Counter()
+        self._attempts = Counter()
+        self._lock = threading.Lock()
+
+    def next(self, key):
+        """Return (delay_seconds, fault) for the next request to key, where fault is None, 'error' or 'rate_limit'"""
+        with self._lock:
+            attempt = self._attempts[key]
+            self._attempts[key] += 1
+            self.stats['requests'] += 1
+        rng = random.Random(f"{self.seed}:{key}:{attempt}")
+        delay = self.latency + rng.uniform(0, self.latency_jitter)
+        roll = rng.random()
+        fault = None
+        if roll < self.rate_limit_rate:
+            fault = 'rate_limit'
+        elif roll < self.rate_limit_rate + self.error_rate:
+            fault = 'error'
+        if fault:
+            with self._lock:
+                self.stats[fault] += 1
+        return delay, fault
+
+class FakeSpotifyCatalog:
+    """Seeded in-memory catalog of playlists and tracks"""
+    def __init__(self, n_playlists=20, tracks_per_playlist=100, seed=0, playlist_ids=(DEFAULT_PLAYLIST_ID,)):
+        rng = random.Random(seed)
+        self.tracks = {}
+        self.playlists = {}
+        words = ['pop', 'hits', 'dance', 'chill', 'tiktok', 'viral', 'rock', 'party', 'mood', 'summer']
+        n_tracks = n_playlists * tracks_per_playlist // 2 or 1
+        track_ids = [_fake_id(rng) for _ in range(n_tracks)]
+        for i, track_id in enumerate(track_ids):
+            artist_index = rng.randrange(max(n_tracks // 10, 1))
+            self.tracks[track_id] = {
+                'id': track_id,
+                'name': f'Track {i}',
+                'artists': [{'id': f'artist{artist_index}', 'name': f'Artist {artist_index}'}],
+                'album': {'name': f'Album {rng.randrange(max(n_tracks // 8, 1))}',
+                          'release_date': f'{rng.randint(1960, 2025)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'},
+                'duration_ms': rng.randint(90000, 360000),
+                'popularity': rng.randint(0, 100),
+                'explicit': rng.random() < 0.2,
+                'preview_url': None
+            }
+        for i in range(n_playlists):
+            # Known IDs first, so scripts with hard-coded playlists work against the fake
+            playlist_id = playlist_ids[i] if i < len(playlist_ids) else _fake_id(rng)
+            size = rng.randint(tracks_per_playlist // 2, tracks_per_playlist) if tracks_per_playlist > 1 else tracks_per_playlist
+            self.playlists[playlist_id] = {
+                'id': playlist_id,
+                'name': f'{rng.choice(words).title()} {rng.choice(words).title()} {i}',
+                'owner': {'display_name': f'user{i}'},
+                'track_ids': rng.sample(track_ids, min(size, len(track_ids)))
+            }
+
+    def audio_features(self, track_id):
+        rng = random.Random(track_id)
+        return {
+            'id': track_id,
+            'danceability': rng.random(),
+            'energy': rng.random(),
+            'key': rng.randint(0, 11),
+            'loudness': rng.uniform(-60, 0),
+            'mode': rng.randint(0, 1),
+            'speechiness': rng.random(),
+            'acousticness': rng.random(),
+            'instrumentalness': rng.random(),
+            'liveness': rng.random(),
+            'valence': rng.random(),
+            'tempo': rng.uniform(50, 200),
+            'duration_ms': self.tracks[track_id]['duration_ms']
+        }
+
+    def playlist_summary(self, playlist):
+        return {
+            'id': playlist['id'],
+            'name': playlist['name'],
+            'owner': playlist['owner'],
+            'tracks': {'total': len(playlist['track_ids'])}
+        }
+
+class _SpotifyHandler(BaseHTTPRequestHandler):
+    # Keep-alive so pooled clients can reuse connections
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        if urlparse(self.path).path.rstrip('/') == '/api/token':
+            self._send_json(200, {'access_token': 'fake-token', 'token_type': 'Bearer', 'expires_in': 3600})
+        else:
+            self._send_json(404, {'error': {'status': 404, 'message': 'Not found'}})
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        path = url.path.rstrip('/')
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        delay, fault = server.faults.next(self.path)
+        if delay:
+            time.sleep(delay)
+        if fault == 'rate_limit':
+            self._send_json(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                            {'Retry-After': str(server.faults.retry_after)})
+            return
+        if fault == 'error':
+            self._send_json(503, {'error': {'status': 503, 'message': 'Service unavailable'}})
+            return
+
+        try:
+            status, body = self._route(path, query)
+        except KeyError:
+            status, body = 404, {'error': {'status': 404, 'message': 'Non existing id'}}
+        self._send_json(status, body)
+
+    def _next_url(self, offset, limit):
+        """Absolute URL of the next page of the current request, like the real API returns"""
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        query.update(offset=offset, limit=limit)
+        return f"http://{self.headers.get('Host')}{url.path}?{urlencode(query)}"
+
+    def _route(self, path, query):
+        catalog = self.server.catalog
+        parts = [part for part in path.split('/') if part]
+        if parts and parts[0] == 'v1':
+            parts = parts[1:]
+
+        limit = int(query.get('limit', 20))
+        offset = int(query.get('offset', 0))
+
+        if parts == ['search']:
+            words = query.get('q', '').lower().split()
+            matches = [catalog.playlist_summary(p) for p in catalog.playlists.values()
+                       if any(word in p['name'].lower() for word in words)]
+            page = matches[offset:offset + limit]
+            return 200, {'playlists': {'items': page, 'total': len(matches), 'limit': limit, 'offset': offset,
+                                       'next': self._next_url(offset + limit, limit)
+                                       if offset + limit < len(matches) else None}}
+        if len(parts) == 2 and parts[0] == 'playlists':
+            return 200, catalog.playlist_summary(catalog.playlists[parts[1]])
+        if len(parts) == 3 and parts[0] == 'playlists' and parts[2] in ('tracks', 'items'):
+            track_ids = catalog.playlists[parts[1]]['track_ids']
+            limit = int(query.get('limit', 100))
+            items = [{'track': {'id': track_id}} for track_id in track_ids[offset:offset + limit]]
+            return 200, {'items': items, 'total': len(track_ids), 'limit': limit, 'offset': offset,
+                         'next': self._next_url(offset + limit, limit) if offset + limit < len(track_ids) else None}
+        if parts == ['tracks']:
+            ids = query.get('ids', '').split(',')
+            return 200, {'tracks': [catalog.tracks.get(track_id) for track_id in ids]}
+        if len(parts) == 2 and parts[0] == 'tracks':
+            return 200, catalog.tracks[parts[1]]
+        if parts == ['audio-features']:
+            ids = query.get('ids', '').split(',')
+            return 200, {'audio_features': [catalog.audio_features(track_id) if track_id in catalog.tracks else None
+                                            for track_id in ids]}
+        if len(parts) == 2 and parts[0] == 'audio-features':
+            return 200, catalog.audio_features(parts[1])
+        return 404, {'error': {'status': 404, 'message': 'Service not found'}}
+
+class FakeSpotifyServer:
+    """In-process HTTP server implementing the Spotify Web API endpoints this project uses"""
+    def __init__(self, catalog=None, host='127.0.0.1', port=0, **fault_options):
+        self.catalog = catalog or FakeSpotifyCatalog()
+        self.faults = FaultInjector(**fault_options)
+        self.httpd = ThreadingHTTPServer((host, port), _SpotifyHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.catalog = self.catalog
+        self.httpd.faults = self.faults
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_url(self):
+        return f"{self.url}/v1/"
+
+    @property
+    def stats(self):
+        return self.faults.stats
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='fake-spotify', daemon=True)
+        self.thread.start()
+        return self
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def spotipy_client(self, **kwargs):
+        """Build a spotipy client that talks to this server instead of api.spotify.com"""
+        import requests
+        import spotipy
+        # Leave retries to the caller by default so their behaviour can be measured
+        kwargs.setdefault('requests_session', requests.Session())
+        client = spotipy.Spotify(auth='fake-token', **kwargs)
+        client.prefix = self.api_url
+        return client
+
+    def spotify_client(self, **kwargs):
+        """Build a pooled SpotifyClient that talks to this server, including its token endpoint"""
+        from spotify_client import SpotifyClient
+        kwargs.setdefault('client_id', 'fake-client-id')
+        kwargs.setdefault('client_secret', 'fake-client-secret')
+        return SpotifyClient(api_url=self.api_url, token_url=f"{self.url}/api/token", **kwargs)
+
+def _offset(seconds):
+    return SimpleNamespace(seconds=int(seconds), microseconds=int(round((seconds % 1) * 1e6)))
+
+def _raise_fake_api_error(fault, retry_after):
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        raise RuntimeError(f"Fake Video Intelligence {fault}")
+    if fault == 'rate_limit':
+        raise exceptions.TooManyRequests(f"Quota exceeded, retry after {retry_after}s")
+    raise exceptions.ServiceUnavailable("The service is currently unavailable")
+
+class FakeOperation:
+    """Long-running operation returned by FakeVideoIntelligenceClient.annotate_video"""
+    def __init__(self, input_uri, delay, fault, retry_after, rng_seed, shots_per_video):
+        self.input_uri = input_uri
+        self.delay = delay
+        self.fault = fault
+        self.retry_after = retry_after
+        self.rng_seed = rng_seed
+        self.shots_per_video = shots_per_video
+
+    def result(self, timeout=None):
+        if timeout is not None and self.delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Operation did not complete within {timeout}s")
+        time.sleep(self.delay)
+        if self.fault:
+            _raise_fake_api_error(self.fault, self.retry_after)
+        return self._build_result()
+
+    def _build_result(self):
+        rng = random.Random(self.rng_seed)
+        labels = [('dance', 'Entertainment'), ('music', 'Music'), ('nature', 'Nature'), ('food', 'Food'),
+                  ('anime', 'Art'), ('party', 'Event'), ('sky', 'Nature'), ('sports', 'Sports')]
+        video_length = rng.uniform(15, 120)
+
+        segment_labels = []
+        for description, category in rng.sample(labels, rng.randint(2, len(labels))):
+            start = rng.uniform(0, video_length / 2)
+            segment_labels.append(SimpleNamespace(
+                entity=SimpleNamespace(description=description),
+                category_entities=[SimpleNamespace(description=category)],
+                segments=[SimpleNamespace(
+                    segment=SimpleNamespace(start_time_offset=_offset(start),
+                                            end_time_offset=_offset(rng.uniform(start, video_length))),
+                    confidence=rng.uniform(0.4, 1.0))]
+            ))
+
+        frames = [SimpleNamespace(time_offset=_offset(t), pornography_likelihood=rng.choice([1, 1, 1, 2, 3]))
+                  for t in range(0, int(video_length), 5)]
+
+        cuts = sorted(rng.uniform(0, video_length) for _ in range(self.shots_per_video - 1))
+        boundaries = [0.0] + cuts + [video_length]
+        shots = [SimpleNamespace(start_time_offset=_offset(start), end_time_offset=_offset(end))
+                 for start, end in zip(boundaries[:-1], boundaries[1:])]
+
+        annotation = SimpleNamespace(
+            segment_label_annotations=segment_labels,
+            explicit_annotation=SimpleNamespace(frames=frames),
+            shot_annotations=shots
+        )
+        return SimpleNamespace(annotation_results=[annotation])
+
+class FakeVideoIntelligenceClient:
+    """Stand-in for VideoIntelligenceServiceClient with configurable latency and error rate"""
+    def __init__(self, latency=0.0, latency_jitter=0.0, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1, seed=0, shots_per_video=20):
+        self.faults = FaultInjector(latency, latency_jitter, error_rate, rate_limit_rate, retry_after, seed)
+        self.seed = seed
+        self.shots_per_video = shots_per_video
+
+    @property
+    def stats(self):
+        return self.faults.stats
+
+    def annotate_video(self, request=None, **kwargs):
+        request = request or kwargs
+        input_uri = request['input_uri']
+        delay, fault = self.faults.next(input_uri)
+        return FakeOperation(input_uri, delay, fault, self.faults.retry_after,
+                             f"{self.seed}:{input_uri}", self.shots_per_video)
+
+class FakeBlob:
+    def __init__(self, bucket, name, data=b'', chunk_size=None):
+        self.bucket = bucket
+        self.name = name
+        self.data = data
+        self.chunk_size = chunk_size
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    @property
+    def md5_hash(self):
+        return base64.b64encode(hashlib.md5(self.data).digest()).decode('ascii')
+
+    def upload_from_filename(self, filename, **kwargs):
+        with open(filename, 'rb') as f:
+            self.data = f.read()
+        with self.bucket.lock:
+            self.bucket.uploads += 1
+            self.bucket._blobs[self.name] = self
+
+    def download_as_bytes(self, **kwargs):
+        return self.data
+
+class FakeBlobIterator:
+    """Mimics the page iterator returned by Bucket.list_blobs"""
+    def __init__(self, blobs, page_size, page_token):
+        start = int(page_token or 0)
+        self.page = blobs[start:start + page_size]
+        self.next_page_token = str(start + page_size) if start + page_size < len(blobs) else None
+        self.blobs = blobs[start:]
+
+    @property
+    def pages(self):
+        return iter([self.page])
+
+    def __iter__(self):
+        return iter(self.blobs)
+
+class FakeBucket:
+    def __init__(self, name):
+        self.name = name
+        self._blobs = {}
+        self.uploads = 0
+        self.lock = threading.Lock()
+
+    def blob(self, name, chunk_size=None):
+        return FakeBlob(self, name, chunk_size=chunk_size)
+
+    def get_blob(self, name):
+        return self._blobs.get(name)
+
+    def list_blobs(self, prefix=None, page_size=None, page_token=None, **kwargs):
+        names = sorted(name for name in self._blobs if not prefix or name.startswith(prefix))
+        blobs = [self._blobs[name] for name in names]
+        return FakeBlobIterator(blobs, page_size or 1000, page_token)
+
+class FakeStorageClient:
+    """Stand-in for google.cloud.storage.Client holding buckets in memory"""
+    def __init__(self, buckets=None):
+        self._buckets = {}
+        for bucket_name, blob_names in (buckets or {}).items():
+            bucket = self.create_bucket(bucket_name)
+            for blob_name in blob_names:
+                bucket._blobs[blob_name] = FakeBlob(bucket, blob_name, hashlib.md5(blob_name.encode()).digest())
+
+    def get_bucket(self, bucket_name):
+        if bucket_name not in self._buckets:
+            try:
+                from google.api_core.exceptions import NotFound
+            except ImportError:
+                raise KeyError(bucket_name)
+            raise NotFound(f"Bucket {bucket_name} not found")
+        return self._buckets[bucket_name]
+
+    def bucket(self, bucket_name):
+        return self._buckets.get(bucket_name) or FakeBucket(bucket_name)
+
+    def create_bucket(self, bucket_name):
+        self._buckets[bucket_name] = FakeBucket(bucket_name)
+        return self._buckets[bucket_name]
+
+class FakeBackends:
+    """Handles to the installed fakes, so tests can inspect stats and shut them down"""
+    def __init__(self, spotify_server, video_client, storage_client, spotify_client=None):
+        self.spotify_server = spotify_server
+        self.video_client = video_client
+        self.storage_client = storage_client
+        self.spotify_client = spotify_client
+
+    def shutdown(self):
+        if self.spotify_client is not None:
+            self.spotify_client.close()
+        self.spotify_server.shutdown()
+
+def install_fake_backends(bucket_name='anime_food_landscape_object_bucket', n_videos=5, n_playlists=20,
+                          tracks_per_playlist=100, latency=0.0, latency_jitter=0.0, error_rate=0.0,
+                          rate_limit_rate=0.0, retry_after=1, seed=0):
+    """Start the fakes and plug them into the Spotify and Google Cloud modules"""
+    import GoogleVideoIntelligenceAPI
+    import recommend_spotify_playlist_music_for_tiktok_edits as spotify_module
+
+    fault_options = dict(latency=latency, latency_jitter=latency_jitter, error_rate=error_rate,
+                         rate_limit_rate=rate_limit_rate, retry_after=retry_after, seed=seed)
+
+    spotify_server = FakeSpotifyServer(FakeSpotifyCatalog(n_playlists, tracks_per_playlist, seed),
+                                       **fault_options).start()
+    spotify_client = spotify_server.spotify_client()
+    spotify_module.set_spotify_client(spotify_client)
+
+    video_client = FakeVideoIntelligenceClient(**fault_options)
+    storage_client = FakeStorageClient({bucket_name: [f'video_{i}.mp4' for i in range(n_videos)]})
+    GoogleVideoIntelligenceAPI.set_clients(storage=storage_client, video=video_client)
+
+    print(f"Fake Spotify API listening on {spotify_server.url}, fake bucket '{bucket_name}' has {n_videos} videos")
+    return FakeBackends(spotify_server, video_client, storage_client, spotify_client)
@@ -0,0 +1,190 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource
+except ImportError:
+    # resource is not available on Windows
+    resource = None
+
+# Completed spans and API counters for the current process
+_lock = threading.Lock()
+_spans = []
+_api_calls = Counter()
+_api_retries = Counter()
+
+# (api_calls, retries) counters of the spans open in the current context, outermost first
+_active_spans = contextvars.ContextVar('active_spans', default=())
+
+def get_peak_rss():
+    """Return the peak resident set size of the process in bytes, or None if unavailable"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def record_api_call(api, count=1):
+    """Count calls made to an external API (e.g. 'spotify', 'video_intelligence')"""
+    with _lock:
+        _api_calls[api] += count
+        for api_calls, _ in _active_spans.get():
+            api_calls[api] += count
+
+def record_retry(api, count=1):
+    """Count retries made against an external API"""
+    with _lock:
+        _api_retries[api] += count
+        for _, retries in _active_spans.get():
+            retries[api] += count
+
+def in_current_context(func):
+    """Wrap func to run in a copy of the caller's context, so that calls it makes from
+    worker threads are counted against the caller's open spans"""
+    context = contextvars.copy_context()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        # A context can only be entered by one thread at a time, so each call gets its own copy
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+@contextmanager
+def span(name, **attributes):
+    """Measure wall time, CPU time, peak RSS and API usage for a block of code"""
+    # Counted only for calls made in this span's context, so overlapping spans don't share counts
+    api_calls = Counter()
+    retries = Counter()
+    token = _active_spans.set(_active_spans.get() + ((api_calls, retries),))
+    start_time = time.time()
+    wall_start = time.perf_counter()
+    # Thread CPU time so that stages running in parallel don't count each other's work
+    cpu_start = time.thread_time()
+    error = None
+    try:
+        yield attributes
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        wall_time = time.perf_counter() - wall_start
+        cpu_time = time.thread_time() - cpu_start
+        _active_spans.reset(token)
+        with _lock:
+            record = {
+                'span': name,
+                'start_time': start_time,
+                'wall_time_s': wall_time,
+                'cpu_time_s': cpu_time,
+                'peak_rss_bytes': get_peak_rss(),
+                'api_calls': dict(api_calls),
+                'retries': dict(retries),
+                'error': error,
+                'thread': threading.current_thread().name,
+                'attributes': attributes
+            }
+            _spans.append(record)
+
+def traced(name=None):
+    """Decorator that wraps every call of a function in a span"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def get_spans():
+    """Return a copy of all completed spans"""
+    with _lock:
+        return list(_spans)
+
+def reset():
+    """Clear all recorded spans and counters"""
+    with _lock:
+        _spans.clear()
+        _api_calls.clear()
+        _api_retries.clear()
+
+def summarize_spans():
+    """Aggregate completed spans by name"""
+    summary = defaultdict(lambda: {'count': 0, 'wall_time_s': 0.0, 'cpu_time_s': 0.0, 'errors': 0})
+    for record in get_spans():
+        entry = summary[record['span']]
+        entry['count'] += 1
+        entry['wall_time_s'] += record['wall_time_s']
+        entry['cpu_time_s'] += record['cpu_time_s']
+        if record['error']:
+            entry['errors'] += 1
+    return dict(summary)
+
+def export_jsonl(output_file):
+    """Append all completed spans to a JSON lines file"""
+    with open(output_file, 'a') as f:
+        for record in get_spans():
+            f.write(json.dumps(record, default=str) + '\n')
+    print(f"Span metrics written to {output_file}")
+    return output_file
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_prometheus():
+    """Render aggregated spans and API counters in the Prometheus text exposition format"""
+    lines = []
+    summary = summarize_spans()
+
+    metrics = [
+        ('pipeline_span_calls_total', 'counter', 'Number of times each span completed', 'count'),
+        ('pipeline_span_errors_total', 'counter', 'Number of spans that raised an exception', 'errors'),
+        ('pipeline_span_wall_seconds_total', 'counter', 'Wall time spent in each span', 'wall_time_s'),
+        ('pipeline_span_cpu_seconds_total', 'counter', 'Thread CPU time spent in each span', 'cpu_time_s'),
+    ]
+    for metric, metric_type, help_text, key in metrics:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {metric_type}")
+        for name, entry in sorted(summary.items()):
+            lines.append(f'{metric}{{span="{_escape_label(name)}"}} {entry[key]}')
+
+    with _lock:
+        api_calls = dict(_api_calls)
+        api_retries = dict(_api_retries)
+    for metric, help_text, counts in [
+        ('pipeline_api_calls_total', 'Number of calls made to each external API', api_calls),
+        ('pipeline_api_retries_total', 'Number of retries made against each external API', api_retries),
+    ]:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for api, count in sorted(counts.items()):
+            lines.append(f'{metric}{{api="{_escape_label(api)}"}} {count}')
+
+    peak_rss = get_peak_rss()
+    if peak_rss is not None:
+        lines.append("# HELP pipeline_peak_rss_bytes Peak resident set size of the process")
+        lines.append("# TYPE pipeline_peak_rss_bytes gauge")
+        lines.append(f"pipeline_peak_rss_bytes {peak_rss}")
+
+    return '\n'.join(lines) + '\n'
+
+def export_prometheus(output_file):
+    """Write aggregated metrics to a Prometheus text file"""
+    with open(output_file, 'w') as f:
+        f.write(format_prometheus())
+    print(f"Prometheus metrics written to {output_file}")
+    return output_file
+
+def export_metrics(output_file):
+    """Export metrics, choosing the format from the file extension (.prom/.txt or .jsonl)"""
+    if os.path.splitext(output_file)[1] in ('.prom', '.txt'):
+        return export_prometheus(output_file)
+    return export_jsonl(output_file)
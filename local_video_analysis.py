@@ -0,0 +1,242 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from instrumentation import span
+
+try:
+    import cv2
+except ImportError:
+    # OpenCV is only needed for the local analysis mode
+    cv2 = None
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm')
+
+# Visual signals produced by the local analyzer and the emotions they suggest.
+# main.EMOTION_MAPPING has matching entries for these labels.
+VISUAL_LABELS = {
+    'bright': 'Visual Lighting',
+    'dark': 'Visual Lighting',
+    'colorful': 'Visual Color',
+    'muted colors': 'Visual Color',
+    'warm colors': 'Visual Color',
+    'cool colors': 'Visual Color',
+    'high motion': 'Visual Motion',
+    'low motion': 'Visual Motion',
+    'fast cuts': 'Visual Pacing',
+    'slow cuts': 'Visual Pacing',
+}
+
+def sample_frame_statistics(video_path, sample_fps=2.0, resize_width=160):
+    """Decode a video, sampling frames at sample_fps, and return per-frame visual statistics"""
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise IOError(f"Could not open video {video_path}")
+
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    step = max(int(round(fps / sample_fps)), 1)
+
+    times, brightness, saturation, warmth, motion, histograms = [], [], [], [], [], []
+    previous_gray = None
+    frame_index = 0
+    try:
+        while True:
+            # grab() skips frames without decoding them; only sampled frames are retrieved
+            if not capture.grab():
+                break
+            if frame_index % step == 0:
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                height, width = frame.shape[:2]
+                small = cv2.resize(frame, (resize_width, max(int(height * resize_width / width), 1)),
+                                   interpolation=cv2.INTER_AREA)
+                hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+                gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+                times.append(frame_index / fps)
+                brightness.append(hsv[:, :, 2].mean() / 255.0)
+                saturation.append(hsv[:, :, 1].mean() / 255.0)
+                # OpenCV hue runs 0-179; reds/oranges/yellows are "warm"
+                hue = hsv[:, :, 0]
+                warmth.append(float(((hue < 30) | (hue >= 160)).mean()))
+                motion.append(0.0 if previous_gray is None else cv2.absdiff(gray, previous_gray).mean() / 255.0)
+                histogram = cv2.calcHist([hsv], [0, 1], None, [16, 8], [0, 180, 0, 256]).ravel()
+                histograms.append(histogram / max(histogram.sum(), 1))
+                previous_gray = gray
+            frame_index += 1
+    finally:
+        capture.release()
+
+    return {
+        'duration': frame_index / fps,
+        'times': np.array(times),
+        'brightness': np.array(brightness),
+        'saturation': np.array(saturation),
+        'warmth': np.array(warmth),
+        'motion': np.array(motion),
+        'histograms': np.array(histograms).reshape(len(histograms), -1)
+    }
+
+def detect_shot_cuts(stats, cut_threshold=0.4):
+    """Return a mask of sampled frames that start a new shot, where the colour histogram changes sharply"""
+    histograms = stats['histograms']
+    is_cut = np.zeros(len(histograms), dtype=bool)
+    if len(histograms) < 2:
+        return is_cut
+    # Total variation distance between consecutive normalized histograms (0 = identical, 1 = disjoint)
+    distances = 0.5 * np.abs(np.diff(histograms, axis=0)).sum(axis=1)
+    is_cut[1:] = distances > cut_threshold
+    return is_cut
+
+def derive_visual_labels(brightness, saturation, warmth, motion, cuts_per_minute):
+    """Map visual statistics for a span of video to (label, confidence) pairs"""
+    labels = []
+    if brightness >= 0.6:
+        labels.append(('bright', brightness))
+    elif brightness <= 0.35:
+        labels.append(('dark', 1 - brightness))
+    if saturation >= 0.45:
+        labels.append(('colorful', saturation))
+    elif saturation <= 0.2:
+        labels.append(('muted colors', 1 - saturation))
+    if warmth >= 0.5:
+        labels.append(('warm colors', warmth))
+    elif warmth <= 0.2:
+        labels.append(('cool colors', 1 - warmth))
+    if motion >= 0.08:
+        labels.append(('high motion', min(motion * 5, 1.0)))
+    elif motion <= 0.02:
+        labels.append(('low motion', 1 - motion * 25))
+    if cuts_per_minute is not None:
+        if cuts_per_minute >= 20:
+            labels.append(('fast cuts', min(cuts_per_minute / 60, 1.0)))
+        elif cuts_per_minute < 6:
+            labels.append(('slow cuts', 1 - cuts_per_minute / 6))
+    return [(label, float(confidence)) for label, confidence in labels]
+
+def _mean_motion(motion):
+    """Mean motion energy, ignoring frames that were cuts (NaN)"""
+    motion = motion[~np.isnan(motion)]
+    return float(motion.mean()) if len(motion) else 0.0
+
+def analyze_local_video(video_path, sample_fps=2.0, cut_threshold=0.4):
+    """Analyze one local video and return label, explicit content and shot rows in the bucket analysis schema"""
+    if cv2 is None:
+        raise ImportError("Local video analysis requires OpenCV (pip install opencv-python)")
+    # Each worker process analyzes one video; keep OpenCV from spawning threads of its own
+    cv2.setNumThreads(1)
+
+    video_name = os.path.basename(video_path)
+    stats = sample_frame_statistics(video_path, sample_fps)
+    duration = stats['duration']
+    is_cut = detect_shot_cuts(stats, cut_threshold)
+    times = stats['times']
+    cuts = times[is_cut]
+    boundaries = np.concatenate([[0.0], cuts, [duration]])
+
+    # The frame difference across a cut is an edit, not motion
+    motion = np.where(is_cut, np.nan, stats['motion'])
+
+    label_results = []
+    shot_results = []
+    for start_time, end_time in zip(boundaries[:-1], boundaries[1:]):
+        shot_results.append({
+            "Video": video_name,
+            "Label Description": "Shot Change",
+            "Category Description": "N/A",
+            "Start Time": float(start_time),
+            "End Time": float(end_time),
+            "Confidence": None
+        })
+
+        # Visual labels for each shot
+        in_shot = (times >= start_time) & (times < end_time)
+        if not in_shot.any():
+            continue
+        shot_labels = derive_visual_labels(stats['brightness'][in_shot].mean(), stats['saturation'][in_shot].mean(),
+                                           stats['warmth'][in_shot].mean(), _mean_motion(motion[in_shot]), None)
+        for label, confidence in shot_labels:
+            label_results.append({
+                "Video": video_name,
+                "Label Description": label,
+                "Category Description": VISUAL_LABELS[label],
+                "Start Time": float(start_time),
+                "End Time": float(end_time),
+                "Confidence": confidence
+            })
+
+    # Whole-video labels, including the editing pace
+    cuts_per_minute = len(cuts) / (duration / 60) if duration > 0 else 0.0
+    if len(times):
+        video_labels = derive_visual_labels(stats['brightness'].mean(), stats['saturation'].mean(),
+                                            stats['warmth'].mean(), _mean_motion(motion), cuts_per_minute)
+        for label, confidence in video_labels:
+            label_results.append({
+                "Video": video_name,
+                "Label Description": label,
+                "Category Description": VISUAL_LABELS[label],
+                "Start Time": 0.0,
+                "End Time": float(duration),
+                "Confidence": confidence
+            })
+
+    # Explicit content can't be detected locally; like the bucket analysis with no flagged frames,
+    # the video gets a mean confidence of 0
+    explicit_results = [{
+        "Video": video_name,
+        "Label Description": "Mean Confidence",
+        "Category Description": "N/A",
+        "Start Time": None,
+        "End Time": None,
+        "Confidence": 0
+    }]
+
+    return label_results, explicit_results, shot_results
+
+def analyze_local_videos(directory, sample_fps=2.0, cut_threshold=0.4, max_workers=None,
+                         excel_file="GoogleVideoIntelligenceLabelAnalyzer_results.xlsx"):
+    """Analyze all videos in a local directory across CPU cores and save the results like analyze_videos_in_bucket"""
+    from GoogleVideoIntelligenceAPI import save_results_to_excel
+
+    video_paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                   if name.lower().endswith(VIDEO_EXTENSIONS)]
+    if not video_paths:
+        print(f"No videos found in '{directory}'.")
+        return None
+
+    label_results = []
+    explicit_results = []
+    shot_results = []
+    failed_videos = []
+
+    print(f"Analyzing {len(video_paths)} local videos at {sample_fps} sampled frames per second...")
+    with span('analyze_local_videos', videos=len(video_paths)):
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            futures = [executor.submit(analyze_local_video, path, sample_fps, cut_threshold) for path in video_paths]
+            for path, future in zip(video_paths, futures):
+                try:
+                    labels, explicit, shots = future.result()
+                except Exception as e:
+                    print(f"Error analyzing video {path}: {e}")
+                    failed_videos.append(path)
+                    continue
+                print(f"Finished processing video {os.path.basename(path)} ({len(shots)} shots).")
+                label_results.extend(labels)
+                explicit_results.extend(explicit)
+                shot_results.extend(shots)
+
+    if len(failed_videos) == len(video_paths):
+        raise RuntimeError("All local videos failed to analyze")
+
+    return save_results_to_excel(label_results, explicit_results, shot_results, excel_file)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Analyze local video files without the cloud API')
+    parser.add_argument('directory', help='Directory containing video files')
+    parser.add_argument('--sample-fps', type=float, default=2.0, help='Frames sampled per second of video')
+    parser.add_argument('--workers', type=int, help='Number of worker processes (default: CPU count)')
+    args = parser.parse_args()
+    analyze_local_videos(args.directory, args.sample_fps, max_workers=args.workers)
@@ -2,40 +2,48 @@
 import os
 import pandas as pd
 import numpy as np
-from AutoLabel import MusicEmotionClassifier
+from AutoLabel import (MusicEmotionClassifier, EMOTION_CATEGORIES, save_emotion_probabilities,
+                       load_emotion_probabilities)
 import argparse
 import sys
-import random
 import tensorflow as tf
 from tensorflow.keras.models import Sequential, load_model
 from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split
 import joblib
 from dotenv import load_dotenv
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-from GoogleVideoIntelligenceAPI import analyze_videos_in_bucket
+from GoogleVideoIntelligenceAPI import analyze_videos_in_bucket, bulk_upload_directory
+from local_video_analysis import analyze_local_videos
+from video_pacing import compute_pacing, summarize_pacing, tempo_match
+from reranking import mmr_rerank, SIMILARITY_FEATURES
+from online_learning import load_latest_classifier, FeedbackLog
+from compact_catalog import CompactCatalog, SortedIndex, load_catalog
+from catalog_filters import (add_filter_columns, build_filter_mask, video_is_explicit,
+                             POPULARITY_BANDS, DURATION_BANDS)
+from instrumentation import span, traced, in_current_context, export_metrics, summarize_spans
 from datetime import datetime
 import json
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Spotify client with environment variables
-spotify = spotipy.Spotify(client_credentials_manager=SpotifyClientCredentials(
-    client_id=os.getenv('SPOTIFY_CLIENT_ID'),
-    client_secret=os.getenv('SPOTIFY_CLIENT_SECRET')
-))
-
 # Set Google Cloud credentials path from environment variable
-os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+if os.getenv('GOOGLE_APPLICATION_CREDENTIALS'):
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
 
 # Get playlist IDs from environment variable
-PLAYLIST_IDS = os.getenv('PLAYLIST_IDS').split(',')
+PLAYLIST_IDS = os.getenv('PLAYLIST_IDS', '').split(',')
 
 # Get bucket name from environment variables
 BUCKET_NAME = os.getenv('BUCKET_NAME', 'music-emotion-classification-videos')
 
+# The last recommendations shown, kept so feedback on them can be recorded in a later run
+LAST_RECOMMENDATIONS_FILE = 'last_recommendations.json'
+
 def fetch_spotify_data(playlist_id=None):
     """Fetch Spotify metadata for a playlist"""
     print("Fetching Spotify metadata...")
@@ -48,17 +56,30 @@ def fetch_spotify_data(playlist_id=None):
     # Fetch metadata
     df = fetch_spotify_metadata(playlist_id)
     
+    # Precompute the filter columns once so recommendation only has to combine masks
+    df = add_filter_columns(df)
+    
     # Export the dataframe to an Excel file
     output_file = 'spotify_metadata.xlsx'
     df.to_excel(output_file, index=False)
     
+    # Also keep a compact Parquet copy, which recommendation loads in preference to the Excel file
+    try:
+        CompactCatalog.from_frame(df).save_parquet(os.path.splitext(output_file)[0] + '.parquet')
+    except ImportError as e:
+        print(f"Skipping Parquet catalog: {e}")
+    
     print(f"Spotify data exported to {output_file}")
     return output_file
 
-def analyze_video(bucket_name):
-    """Analyze video content using Google Cloud Video Intelligence API"""
+def analyze_video(bucket_name, local_video_dir=None, sample_fps=2.0):
+    """Analyze video content using Google Cloud Video Intelligence API, or locally from a directory of videos"""
     print("Analyzing video content...")
     
+    if local_video_dir:
+        # Offline preview: decode the files locally instead of uploading them for cloud analysis
+        return analyze_local_videos(local_video_dir, sample_fps)
+    
     try:
         # Try to import and run the actual video analysis
         video_data_path = analyze_videos_in_bucket(bucket_name)
@@ -130,8 +151,20 @@ def train_emotion_classifier(spotify_data_path):
 
 def recommend_music_for_video(video_data_path='GoogleVideoIntelligenceLabelAnalyzer_results.xlsx', 
                         spotify_data_path='spotify_metadata.xlsx',
-                        model_path='emotion_classifier_model.h5'):
-    """Recommend music for a video based on its content"""
+                        model_path='emotion_classifier_model.h5', filters=None,
+                        top_k=10, diversity=0.3, max_per_artist=2,
+                        probabilities_path='emotion_probabilities.npz',
+                        recommendations_path=LAST_RECOMMENDATIONS_FILE):
+    """Recommend music for a video based on its content.
+
+    filters are keyword arguments for catalog_filters.build_filter_mask; unless
+    allow_explicit is given, explicit tracks are only allowed for explicit videos.
+    The top_k tracks are reranked for variety (see reranking.mmr_rerank); set
+    diversity=0 and max_per_artist=None for a plain top-k by match score.
+    Per-track emotion probabilities are cached in probabilities_path for the loaded model.
+    The recommended tracks are saved to recommendations_path, so feedback on them can be
+    recorded later with record_recommendation_feedback.
+    """
     print("Recommending music for video...")
     
     # Default video data if file doesn't exist (for testing)
@@ -144,9 +177,14 @@ def recommend_music_for_video(video_data_path='GoogleVideoIntelligenceLabelAnaly
             'Confidence': [0.9, 0.8, 0.7, 0.6, 0.5] * 5
         }
         video_df = pd.DataFrame(video_data)
+        shot_df = None
+        explicit_df = None
     else:
-        # Load video analysis data
-        video_df = pd.read_excel(video_data_path)
+        # Load video analysis data (label sheet first, plus shot detection when present)
+        sheets = pd.read_excel(video_data_path, sheet_name=None)
+        video_df = sheets.get('Label Detection', next(iter(sheets.values())))
+        shot_df = sheets.get('Shot Detection')
+        explicit_df = sheets.get('Explicit Content Detection')
     
     # Extract dominant labels and categories
     label_counts = video_df["Label Description"].value_counts()
@@ -158,127 +196,282 @@ def recommend_music_for_video(video_data_path='GoogleVideoIntelligenceLabelAnaly
     print(f"Top video labels: {', '.join(top_labels)}")
     print(f"Top video categories: {', '.join(top_categories)}")
     
-    # Determine target emotions based on video content
-    target_emotions = map_video_content_to_emotions(top_labels, top_categories)
-    print(f"Target emotions based on video content: {', '.join(target_emotions)}")
-    
-    # Load music data
-    music_df = pd.read_excel(spotify_data_path)
+    # Determine the video's emotion distribution based on its content
+    video_emotions = video_emotion_distribution(label_counts.head(5), category_counts.head(5))
+    print("Video emotions: " + ", ".join(f"{emotion} {weight:.2f}" for emotion, weight
+                                         in zip(EMOTION_CATEGORIES, video_emotions) if weight > 0))
+    
+    # Target tempo and energy from the video's editing pace
+    pacing = None
+    if shot_df is not None and not shot_df.empty:
+        pacing = summarize_pacing(compute_pacing(shot_df))
+    if pacing:
+        tempo_text = f"{pacing['target_tempo']:.0f} BPM" if pacing['target_tempo'] else "n/a"
+        print(f"Video pacing: {pacing['cuts_per_minute']:.1f} cuts/min, median shot {pacing['median_shot_length']:.1f}s "
+              f"-> target tempo {tempo_text}, target energy {pacing['target_energy']:.2f}")
+    
+    # Load the catalog in its compact form and drop tracks the filters rule out before any per-track work
+    with span('load_catalog'):
+        catalog = load_catalog(spotify_data_path)
+    filters = dict(filters or {})
+    if filters.get('allow_explicit') is None:
+        filters['allow_explicit'] = video_is_explicit(explicit_df)
+    with span('filter_catalog', tracks=len(catalog)):
+        mask = build_filter_mask(catalog, **filters)
+        catalog = catalog.take(mask)
+    print(f"{len(catalog)} of {len(mask)} tracks pass the catalog filters"
+          f"{'' if filters['allow_explicit'] else ' (explicit tracks excluded)'}")
+    if catalog.empty:
+        print("No tracks left to recommend.")
+        return pd.DataFrame(columns=['track_name', 'artist', 'predicted_emotion', 'match_score'])
+    
+    # Load classifier, preferring the latest version published by online learning
+    try:
+        classifier = load_latest_classifier(base_model_path=model_path)
+    except Exception as e:
+        print(f"Warning: could not load the latest published model ({e}); using {model_path}")
+        classifier = None
+    if classifier is None:
+        classifier = MusicEmotionClassifier()
+        if os.path.exists(model_path):
+            try:
+                classifier.load_model(model_path)
+            except Exception as e:
+                print(f"Error loading model: {e}")
+                print("Training new model...")
+                classifier = train_emotion_classifier(spotify_data_path)
+        else:
+            print("No pretrained model found. Training new model...")
+            classifier = train_emotion_classifier(spotify_data_path)
     
-    # Load classifier
-    classifier = MusicEmotionClassifier()
-    if os.path.exists(model_path):
+    # Extract features for prediction using random values (for demo)
+    n_tracks = len(catalog)
+    features_df = pd.DataFrame({
+        'danceability': np.random.uniform(0, 1, n_tracks),
+        'energy': np.random.uniform(0, 1, n_tracks),
+        'key': np.random.randint(0, 12, n_tracks),
+        'loudness': np.random.uniform(-60, 0, n_tracks),
+        'mode': np.random.randint(0, 2, n_tracks),
+        'speechiness': np.random.uniform(0, 1, n_tracks),
+        'acousticness': np.random.uniform(0, 1, n_tracks),
+        'instrumentalness': np.random.uniform(0, 1, n_tracks),
+        'liveness': np.random.uniform(0, 1, n_tracks),
+        'valence': np.random.uniform(0, 1, n_tracks),
+        'tempo': np.random.uniform(50, 200, n_tracks),
+        'duration_ms': catalog['duration_ms'] if 'duration_ms' in catalog else 0,
+        'popularity': catalog['popularity'] if 'popularity' in catalog else 0
+    }).astype(float)
+    
+    # Emotion probabilities for each track; only tracks without stored probabilities
+    # from the same model are run through the classifier, and tracks with them reuse
+    # the features they were predicted from
+    track_ids = catalog.track_ids if 'track_id' in catalog else None
+    stored = None
+    if track_ids is not None and os.path.exists(probabilities_path):
         try:
-            classifier.load_model()
+            stored = load_emotion_probabilities(probabilities_path)
         except Exception as e:
-            print(f"Error loading model: {e}")
-            print("Training new model...")
-            classifier = train_emotion_classifier(spotify_data_path)
+            print(f"Warning: could not read stored emotion probabilities ({e}); predicting all tracks")
+        if stored and (stored['model_tag'] != classifier.model_tag
+                       or stored['feature_columns'] != classifier.feature_columns):
+            stored = None
+    if stored:
+        # Compare IDs as str on both sides; casting to the cached array's fixed width could cut them short
+        stored_ids = stored['track_ids'].astype(str)
+        query_ids = track_ids.astype(str)
+        rows = SortedIndex(stored_ids).get_indexer(query_ids)
+        found = rows >= 0
+        # Only reuse a cached row if it really is the same track
+        rows[found] = np.where(stored_ids[rows[found]] == query_ids[found], rows[found], -1)
     else:
-        print("No pretrained model found. Training new model...")
-        classifier = train_emotion_classifier(spotify_data_path)
-    
-    # Extract features for prediction using random values (for demo)
-    features = []
-    for _, row in music_df.iterrows():
-        feature_dict = {
-            'danceability': random.uniform(0, 1),
-            'energy': random.uniform(0, 1),
-            'key': random.randint(0, 11),
-            'loudness': random.uniform(-60, 0),
-            'mode': random.randint(0, 1),
-            'speechiness': random.uniform(0, 1),
-            'acousticness': random.uniform(0, 1),
-            'instrumentalness': random.uniform(0, 1),
-            'liveness': random.uniform(0, 1),
-            'valence': random.uniform(0, 1),
-            'tempo': random.uniform(50, 200),
-            'duration_ms': row.get('duration_ms', 0),
-            'popularity': row.get('popularity', 0)
-        }
-        features.append(feature_dict)
-    
-    features_df = pd.DataFrame(features)
-    
-    # Predict emotions for each track
-    predicted_emotions, emotion_scores = classifier.predict_emotion(features_df)
-    
-    # Create recommendations dataframe
-    recommendations = pd.DataFrame({
-        'track_name': music_df['track_name'],
-        'artist': music_df['artist'],
-        'predicted_emotion': predicted_emotions
-    })
+        rows = np.full(n_tracks, -1)
+    missing = rows < 0
+    emotion_scores = np.zeros((n_tracks, len(classifier.emotion_categories)), dtype=np.float32)
+    if stored:
+        emotion_scores[~missing] = stored['probabilities'][rows[~missing]]
+        features_df.loc[~missing, classifier.feature_columns] = stored['features'][rows[~missing]]
+        print(f"Using stored emotion probabilities for {(~missing).sum()} of {n_tracks} tracks")
+    if missing.any():
+        _, emotion_scores[missing] = classifier.predict_emotion(features_df[missing])
+        if track_ids is not None:
+            all_ids = track_ids[missing].astype(str)
+            all_scores = emotion_scores[missing]
+            all_features = features_df.loc[missing, classifier.feature_columns].to_numpy(dtype=np.float32)
+            if stored:
+                all_ids = np.concatenate([stored['track_ids'].astype(str), all_ids])
+                all_scores = np.concatenate([stored['probabilities'], all_scores])
+                all_features = np.concatenate([stored['features'], all_features])
+            save_emotion_probabilities(probabilities_path, all_ids, all_scores, classifier.emotion_categories,
+                                       classifier.thresholds, classifier.model_tag, all_features,
+                                       classifier.feature_columns)
     
     # Calculate emotion match scores
-    match_scores = []
-    for i, emotion in enumerate(predicted_emotions):
-        score = 0
-        if emotion in target_emotions:
-            # Base score for matching emotion
-            score = 100
-            
-            # Bonus for popularity
-            popularity = music_df.iloc[i].get('popularity', 0)
-            score += min(popularity, 30)  # Max 30 points for popularity
-            
-            # Bonus for energy match with video intensity
-            avg_confidence = video_df['Confidence'].mean()
-            energy = features_df.iloc[i]['energy']
-            energy_match = 1 - abs(avg_confidence - energy)
-            score += energy_match * 20  # Max 20 points for energy match
-        
-        match_scores.append(score)
+    match_scores = score_tracks(emotion_scores, video_emotions, catalog, features_df, video_df, pacing)
     
-    recommendations['match_score'] = match_scores
+    # Pick the top tracks, trading match score against similarity to tracks already picked
+    with span('rerank', tracks=n_tracks, k=top_k):
+        ranked = mmr_rerank(match_scores, features_df[SIMILARITY_FEATURES].to_numpy(),
+                            catalog['artist'].cat.codes.to_numpy(), emotion_scores, k=top_k,
+                            diversity=diversity, max_per_artist=max_per_artist)
     
-    # Sort by match score
-    recommended_tracks = recommendations.sort_values('match_score', ascending=False).head(10)
+    # Decode names only for the recommended tracks
+    recommended_tracks = catalog.to_frame(ranked, [name for name in ('track_id', 'track_name', 'artist')
+                                                   if name in catalog])
+    recommended_tracks['predicted_emotion'] = [', '.join(labels) for labels
+                                               in classifier.emotion_labels(emotion_scores[ranked])]
+    recommended_tracks['match_score'] = match_scores[ranked]
     
     print("\nTop recommended tracks for your video:")
     for i, (_, track) in enumerate(recommended_tracks.iterrows(), 1):
         print(f"{i}. {track['track_name']} by {track['artist']} - {track['predicted_emotion']} (Score: {track['match_score']:.1f})")
     
+    if 'track_id' in recommended_tracks:
+        save_recommendations(recommendations_path, recommended_tracks,
+                             features_df.iloc[ranked][classifier.feature_columns],
+                             EMOTION_CATEGORIES[int(np.argmax(video_emotions))])
+    
     return recommended_tracks
 
+def save_recommendations(path, recommended_tracks, track_features, video_emotion):
+    """Save the tracks shown to the user with the features they were scored on, for later feedback"""
+    saved = {
+        'time': datetime.now().isoformat(),
+        'video_emotion': video_emotion,
+        'tracks': [{'track_id': track['track_id'], 'track_name': track['track_name'], 'artist': track['artist'],
+                    'features': {key: float(value) for key, value in features.items()}}
+                   for (_, track), (_, features) in zip(recommended_tracks.iterrows(), track_features.iterrows())]
+    }
+    # Replace the previous set in one step, so --feedback never reads a half-written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(saved, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+def record_recommendation_feedback(chosen_track_ids, recommendations_path=LAST_RECOMMENDATIONS_FILE,
+                                   feedback_log=None):
+    """Log each track of the last saved recommendations as chosen (in chosen_track_ids) or skipped.
+
+    Events carry the video's dominant emotion and the features the track was scored on, so
+    online_learning can apply them without looking the tracks up again. The saved set is
+    removed afterwards, so the same recommendations can't be logged twice.
+    """
+    if not os.path.exists(recommendations_path):
+        print(f"No saved recommendations in {recommendations_path}; run --recommend first.")
+        return []
+    with open(recommendations_path) as f:
+        saved = json.load(f)
+    feedback_log = feedback_log or FeedbackLog()
+    chosen_track_ids = set(chosen_track_ids)
+    unknown = chosen_track_ids - {track['track_id'] for track in saved['tracks']}
+    if unknown:
+        print(f"Ignoring chosen tracks that were not recommended: {', '.join(sorted(unknown))}")
+    events = [feedback_log.record(track['track_id'], track['track_id'] in chosen_track_ids, saved['video_emotion'],
+                                  track['features']) for track in saved['tracks']]
+    os.remove(recommendations_path)
+    chosen = sum(event['chosen'] for event in events)
+    print(f"Recorded feedback for {len(events)} tracks ({chosen} chosen, {len(events) - chosen} skipped) "
+          f"in {feedback_log.path}")
+    return events
+
+def score_tracks(emotion_probabilities, video_emotions, music_df, features_df, video_df, pacing=None):
+    """Calculate emotion match scores for each track.
+
+    emotion_probabilities is the (tracks x emotions) probability matrix and video_emotions
+    the video's emotion distribution over EMOTION_CATEGORIES; the emotion overlap between
+    them (one matrix-vector product) scales each track's score.
+    """
+    with span('score_tracks', tracks=len(music_df)):
+        # Soft overlap between each track's emotions and the video's, from 0 to 1
+        overlap = np.asarray(emotion_probabilities, dtype=np.float32) @ np.asarray(video_emotions, dtype=np.float32)
+        
+        # Base score for matching emotion
+        scores = np.full(len(music_df), 100.0)
+        
+        # Bonus for popularity
+        if 'popularity' in music_df:
+            scores += np.minimum(music_df['popularity'].fillna(0).to_numpy(dtype=float), 30)  # Max 30 points for popularity
+        
+        # Bonus for energy match with the video's pace (or its label confidence when there are no shots)
+        target_energy = pacing['target_energy'] if pacing else video_df['Confidence'].mean()
+        energy_match = 1 - np.abs(target_energy - features_df['energy'].to_numpy(dtype=float))
+        scores += energy_match * 20  # Max 20 points for energy match
+        
+        # Bonus for tempo that lines up with the cut rhythm
+        if pacing and pacing['target_tempo']:
+            scores += tempo_match(features_df['tempo'].to_numpy(dtype=float), pacing['target_tempo']) * 20  # Max 20 points for tempo match
+        
+        return np.clip(overlap, 0.0, 1.0) * scores
+
+EMOTION_MAPPING = {
+    # Common labels
+    'dance': ['energetic', 'happy'],
+    'performance': ['energetic'],
+    'music': ['happy', 'energetic'],
+    'fun': ['happy'],
+    'smile': ['happy'],
+    'nature': ['calm'],
+    'water': ['calm'],
+    'sky': ['calm'],
+    'fight': ['aggressive'],
+    'explosion': ['aggressive'],
+    'romance': ['calm', 'sad'],
+    'love': ['happy', 'calm'],
+    'food': ['happy'],
+    'sports': ['energetic'],
+    'game': ['energetic'],
+    'cry': ['sad'],
+    'night': ['calm', 'sad'],
+    'sunset': ['calm'],
+    'party': ['happy', 'energetic'],
+    
+    # Categories
+    'Entertainment': ['happy', 'energetic'],
+    'Sports': ['energetic'],
+    'Art': ['calm'],
+    'Nature': ['calm'],
+    'Action': ['energetic', 'aggressive'],
+    'Drama': ['sad', 'calm'],
+    'Comedy': ['happy'],
+    'Adventure': ['energetic'],
+    'Romance': ['calm', 'sad'],
+    
+    # Visual signals from local video analysis
+    'bright': ['happy'],
+    'dark': ['sad', 'calm'],
+    'colorful': ['happy', 'energetic'],
+    'muted colors': ['calm', 'sad'],
+    'warm colors': ['happy'],
+    'cool colors': ['calm'],
+    'high motion': ['energetic'],
+    'low motion': ['calm'],
+    'fast cuts': ['energetic', 'aggressive'],
+    'slow cuts': ['calm']
+}
+
+# Emotions assumed for videos with no recognised labels or categories
+DEFAULT_EMOTIONS = ['energetic', 'happy']
+
+def video_emotion_distribution(label_counts, category_counts):
+    """Spread the video's label and category counts over the emotions they map to, summing to 1"""
+    weights = np.zeros(len(EMOTION_CATEGORIES))
+    for name, count in list(label_counts.items()) + list(category_counts.items()):
+        name_lower = str(name).lower()
+        for key, emotions in EMOTION_MAPPING.items():
+            if key.lower() in name_lower:
+                for emotion in emotions:
+                    weights[EMOTION_CATEGORIES.index(emotion)] += count / len(emotions)
+    if weights.sum() == 0:
+        for emotion in DEFAULT_EMOTIONS:
+            weights[EMOTION_CATEGORIES.index(emotion)] = 1.0
+    return weights / weights.sum()
+
 def map_video_content_to_emotions(labels, categories):
     """Map video content to target emotions"""
-    emotion_mapping = {
-        # Common labels
-        'dance': ['energetic', 'happy'],
-        'performance': ['energetic'],
-        'music': ['happy', 'energetic'],
-        'fun': ['happy'],
-        'smile': ['happy'],
-        'nature': ['calm'],
-        'water': ['calm'],
-        'sky': ['calm'],
-        'fight': ['aggressive'],
-        'explosion': ['aggressive'],
-        'romance': ['calm', 'sad'],
-        'love': ['happy', 'calm'],
-        'food': ['happy'],
-        'sports': ['energetic'],
-        'game': ['energetic'],
-        'cry': ['sad'],
-        'night': ['calm', 'sad'],
-        'sunset': ['calm'],
-        'party': ['happy', 'energetic'],
-        
-        # Categories
-        'Entertainment': ['happy', 'energetic'],
-        'Sports': ['energetic'],
-        'Art': ['calm'],
-        'Nature': ['calm'],
-        'Action': ['energetic', 'aggressive'],
-        'Drama': ['sad', 'calm'],
-        'Comedy': ['happy'],
-        'Adventure': ['energetic'],
-        'Romance': ['calm', 'sad']
-    }
+    emotion_mapping = EMOTION_MAPPING
     
     # Default emotions if no matches
-    target_emotions = set(['energetic', 'happy'])
+    target_emotions = set(DEFAULT_EMOTIONS)
     
     # Find matches in labels
     for label in labels:
@@ -298,19 +491,111 @@ def map_video_content_to_emotions(labels, categories):
     
     return list(target_emotions)
 
-def main():
-    parser = argparse.ArgumentParser(description='Music Emotion Classification and Video Recommendation System')
-    parser.add_argument('--fetch-spotify', action='store_true', help='Fetch Spotify data')
-    parser.add_argument('--playlist-id', type=str, help='Spotify playlist ID to fetch')
-    parser.add_argument('--analyze-video', action='store_true', help='Analyze video content')
-    parser.add_argument('--bucket-name', type=str, default='anime_food_landscape_object_bucket', help='Google Cloud bucket name for videos')
-    parser.add_argument('--train-model', action='store_true', help='Train emotion classifier model')
-    parser.add_argument('--recommend', action='store_true', help='Recommend music for video')
-    parser.add_argument('--full-pipeline', action='store_true', help='Run the full pipeline')
-    args = parser.parse_args()
-    
+async def run_pipeline_async(playlist_id, bucket_name, local_video_dir=None, sample_fps=2.0,
+                             recommend_options=None):
+    """Run the full pipeline with Spotify ingestion and video analysis overlapped"""
+    loop = asyncio.get_running_loop()
+    pipeline_start = time.perf_counter()
+    stage_timings = {}
+
+    async def run_stage(executor, name, func, *args):
+        # Run a blocking stage in the executor and record when it started and finished
+        start = time.perf_counter() - pipeline_start
+        print(f"[{start:7.2f}s] Starting stage: {name}")
+        result = await loop.run_in_executor(executor, in_current_context(traced(name)(func)), *args)
+        end = time.perf_counter() - pipeline_start
+        stage_timings[name] = (start, end)
+        print(f"[{end:7.2f}s] Finished stage: {name} ({end - start:.2f}s)")
+        return result
+
+    async def spotify_branch(executor):
+        # Training only needs the Spotify data, so it can start before video analysis is done
+        path = await run_stage(executor, 'fetch_spotify', fetch_spotify_data, playlist_id)
+        await run_stage(executor, 'train_model', train_emotion_classifier, path)
+        return path
+
+    # Spotify-bound and Video Intelligence-bound work don't depend on each other
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        spotify_data_path, video_data_path = await asyncio.gather(
+            spotify_branch(executor),
+            run_stage(executor, 'analyze_video', analyze_video, bucket_name, local_video_dir, sample_fps)
+        )
+        recommendations = await run_stage(executor, 'recommend',
+                                          functools.partial(recommend_music_for_video, **(recommend_options or {})),
+                                          video_data_path, spotify_data_path)
+
+    total_time = time.perf_counter() - pipeline_start
+    print_stage_summary(stage_timings, total_time)
+    return recommendations
+
+def print_stage_summary(stage_timings, total_time):
+    """Print per-stage timing, overlap and idle time for a pipeline run"""
+    print("\nPipeline stage summary:")
+    print(f"{'Stage':<16}{'Start':>10}{'End':>10}{'Duration':>10}")
+    for name, (start, end) in sorted(stage_timings.items(), key=lambda item: item[1][0]):
+        print(f"{name:<16}{start:>9.2f}s{end:>9.2f}s{end - start:>9.2f}s")
+
+    # Time spent waiting at the join before recommendation could start
+    join_time = stage_timings['recommend'][0] if 'recommend' in stage_timings else total_time
+    branch_ends = {
+        'spotify branch': max(stage_timings[name][1] for name in ('fetch_spotify', 'train_model') if name in stage_timings),
+        'video branch': stage_timings['analyze_video'][1]
+    }
+    for branch, end in branch_ends.items():
+        print(f"Idle time for {branch} waiting at join: {max(join_time - end, 0):.2f}s")
+
+    # Time where no stage at all was running
+    busy_time = 0.0
+    busy_until = 0.0
+    for start, end in sorted(stage_timings.values()):
+        if end > busy_until:
+            busy_time += end - max(start, busy_until)
+            busy_until = end
+    serial_time = sum(end - start for start, end in stage_timings.values())
+    print(f"Pipeline idle time (no stage running): {max(total_time - busy_time, 0):.2f}s")
+    print(f"Total wall time: {total_time:.2f}s (serial stage time {serial_time:.2f}s, saved {max(serial_time - total_time, 0):.2f}s by overlapping)")
+
+def print_metrics_summary():
+    """Print aggregated span timings collected during the run"""
+    summary = summarize_spans()
+    if not summary:
+        return
+    print("\nTiming summary:")
+    print(f"{'Span':<24}{'Calls':>8}{'Wall':>10}{'CPU':>10}")
+    for name, entry in sorted(summary.items(), key=lambda item: -item[1]['wall_time_s']):
+        print(f"{name:<24}{entry['count']:>8}{entry['wall_time_s']:>9.2f}s{entry['cpu_time_s']:>9.2f}s")
+
+def run_requested_stages(parser, args):
+    """Run the pipeline stages selected on the command line"""
     spotify_data_path = 'spotify_metadata.xlsx'
     video_data_path = 'GoogleVideoIntelligenceLabelAnalyzer_results.xlsx'
+    recommend_options = {
+        'filters': {
+            'allow_explicit': args.allow_explicit,
+            'popularity_bands': args.popularity_bands,
+            'duration_bands': args.duration_bands,
+            'min_year': args.min_year,
+            'max_year': args.max_year
+        },
+        'diversity': args.diversity,
+        'max_per_artist': args.max_per_artist or None
+    }
+    
+    # Record feedback on the recommendations shown last time, before anything replaces them
+    if args.feedback is not None:
+        record_recommendation_feedback(args.feedback)
+    
+    # Upload local videos to the bucket first, so every pipeline mode analyzes them
+    if args.upload_dir:
+        with span('upload_videos'):
+            bulk_upload_directory(args.bucket_name, args.upload_dir, max_workers=args.upload_workers)
+    
+    # Run the overlapped pipeline if requested
+    if args.async_pipeline:
+        asyncio.run(run_pipeline_async(args.playlist_id, args.bucket_name, args.local_video_dir, args.sample_fps,
+                                       recommend_options))
+        print_metrics_summary()
+        return
     
     # Run full pipeline if requested
     if args.full_pipeline:
@@ -321,24 +606,74 @@ def main():
     
     # Fetch Spotify data
     if args.fetch_spotify:
-        spotify_data_path = fetch_spotify_data(args.playlist_id)
+        with span('fetch_spotify'):
+            spotify_data_path = fetch_spotify_data(args.playlist_id)
     
     # Analyze video
     if args.analyze_video:
-        video_data_path = analyze_video(args.bucket_name)
+        with span('analyze_video'):
+            video_data_path = analyze_video(args.bucket_name, args.local_video_dir, args.sample_fps)
     
     # Train emotion classifier
     if args.train_model:
-        train_emotion_classifier(spotify_data_path)
+        with span('train_model'):
+            train_emotion_classifier(spotify_data_path)
     
     # Recommend music for video
     if args.recommend:
-        recommend_music_for_video(video_data_path, spotify_data_path)
+        with span('recommend'):
+            recommend_music_for_video(video_data_path, spotify_data_path, **recommend_options)
+    
+    print_metrics_summary()
     
     # If no arguments provided, show help
     if not any(vars(args).values()):
         parser.print_help()
 
+def main():
+    parser = argparse.ArgumentParser(description='Music Emotion Classification and Video Recommendation System')
+    parser.add_argument('--fetch-spotify', action='store_true', help='Fetch Spotify data')
+    parser.add_argument('--playlist-id', type=str, help='Spotify playlist ID to fetch')
+    parser.add_argument('--analyze-video', action='store_true', help='Analyze video content')
+    parser.add_argument('--bucket-name', type=str, default='anime_food_landscape_object_bucket', help='Google Cloud bucket name for videos')
+    parser.add_argument('--local-video-dir', type=str, help='Analyze video files in this local directory instead of the bucket')
+    parser.add_argument('--sample-fps', type=float, default=2.0, help='Frames sampled per second for local video analysis')
+    parser.add_argument('--upload-dir', type=str, help='Upload the videos in this local directory to the bucket before analysis')
+    parser.add_argument('--upload-workers', type=int, default=8, help='Number of parallel uploads for --upload-dir')
+    parser.add_argument('--train-model', action='store_true', help='Train emotion classifier model')
+    parser.add_argument('--recommend', action='store_true', help='Recommend music for video')
+    parser.add_argument('--allow-explicit', action=argparse.BooleanOptionalAction, default=None,
+                        help='Allow or exclude explicit tracks (default: allow only for explicit videos)')
+    parser.add_argument('--popularity-bands', nargs='+', choices=list(POPULARITY_BANDS),
+                        help='Only recommend tracks in these popularity bands')
+    parser.add_argument('--duration-bands', nargs='+', choices=list(DURATION_BANDS),
+                        help='Only recommend tracks in these duration bands')
+    parser.add_argument('--min-year', type=int, help='Only recommend tracks released in or after this year')
+    parser.add_argument('--max-year', type=int, help='Only recommend tracks released in or before this year')
+    parser.add_argument('--diversity', type=float, default=0.3,
+                        help='Weight of variety against match score when picking the top tracks (0 = match score only)')
+    parser.add_argument('--max-per-artist', type=int, default=2, help='Most tracks per artist in the recommendations (0 = no cap)')
+    parser.add_argument('--feedback', nargs='*', metavar='TRACK_ID',
+                        help='Record feedback on the last recommendations: these tracks were used, the rest skipped')
+    parser.add_argument('--full-pipeline', action='store_true', help='Run the full pipeline')
+    parser.add_argument('--async-pipeline', action='store_true', help='Run the full pipeline with Spotify ingestion and video analysis in parallel')
+    parser.add_argument('--fake-backends', action='store_true', help='Use local fake Spotify and Google Cloud backends (offline)')
+    parser.add_argument('--metrics-output', type=str, help='Write stage metrics to this file (.jsonl for spans, .prom for Prometheus text)')
+    args = parser.parse_args()
+    
+    backends = None
+    if args.fake_backends:
+        from fake_backends import install_fake_backends
+        backends = install_fake_backends(bucket_name=args.bucket_name)
+    
+    try:
+        run_requested_stages(parser, args)
+    finally:
+        if args.metrics_output:
+            export_metrics(args.metrics_output)
+        if backends is not None:
+            backends.shutdown()
+
 if __name__ == "__main__":
     try:
         main()
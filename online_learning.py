@@ -0,0 +1,344 @@
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from AutoLabel import MusicEmotionClassifier, get_model_tag
+from instrumentation import span
+
+# Feedback log and published model versions (not committed to git)
+FEEDBACK_LOG = os.path.join('feedback', 'feedback.jsonl')
+MODEL_DIR = 'models'
+LATEST_FILE = 'LATEST'
+MODEL_FILE = 'emotion_classifier_model.h5'
+SCALER_FILE = 'emotion_scaler.pkl'
+STATE_FILE = 'state.json'
+REPLAY_FILE = 'replay.npz'
+
+class FeedbackLog:
+    """Append-only JSON lines log of recommendation feedback.
+
+    Events are flushed to disk as they are written. Readers tail the log from a
+    byte offset, so a learner only ever holds the events it has not applied yet.
+    """
+    def __init__(self, path=FEEDBACK_LOG):
+        self.path = path
+
+    def record(self, track_id, chosen, video_emotion, features=None):
+        """Append one feedback event: the track was chosen (True) or skipped (False) for a video"""
+        event = {
+            'time': datetime.now().isoformat(),
+            'track_id': track_id,
+            'chosen': bool(chosen),
+            'video_emotion': video_emotion
+        }
+        if features is not None:
+            event['features'] = {key: float(value) for key, value in dict(features).items()}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(event) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        return event
+
+    def read(self, offset=0, max_events=None):
+        """Return (events, next_offset) for complete lines after offset"""
+        events = []
+        if not os.path.exists(self.path):
+            return events, offset
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while max_events is None or len(events) < max_events:
+                line = f.readline()
+                # A line without a newline is still being written; pick it up next time
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    print(f"Skipping corrupt feedback record at byte {offset - len(line)}")
+        return events, offset
+
+class ReplayBuffer:
+    """Fixed-size reservoir of past (features, target) pairs.
+
+    Every example seen has the same chance of being in the buffer, so replaying it
+    alongside new feedback keeps the model from forgetting older behaviour, and the
+    memory used never grows past capacity rows.
+    """
+    def __init__(self, capacity, n_features, n_classes, seed=0):
+        self.capacity = capacity
+        self.X = np.zeros((capacity, n_features), dtype=np.float32)
+        self.y = np.zeros((capacity, n_classes), dtype=np.float32)
+        self.size = 0
+        self.seen = 0
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, X, y):
+        for features, target in zip(X, y):
+            if self.size < self.capacity:
+                slot = self.size
+                self.size += 1
+            else:
+                slot = self.rng.integers(0, self.seen + 1)
+            if slot < self.capacity:
+                self.X[slot] = features
+                self.y[slot] = target
+            self.seen += 1
+
+    def sample(self, batch_size):
+        if self.size == 0:
+            return self.X[:0], self.y[:0]
+        indices = self.rng.choice(self.size, size=min(batch_size, self.size), replace=False)
+        return self.X[indices], self.y[indices]
+
+    def save(self, path):
+        np.savez_compressed(path, X=self.X[:self.size], y=self.y[:self.size], seen=self.seen)
+
+    def load(self, path):
+        data = np.load(path)
+        self.size = min(len(data['X']), self.capacity)
+        self.X[:self.size] = data['X'][:self.size]
+        self.y[:self.size] = data['y'][:self.size]
+        self.seen = int(data['seen'])
+
+def latest_model_version(model_dir=MODEL_DIR):
+    """Return the directory of the latest published model version, or None"""
+    try:
+        with open(os.path.join(model_dir, LATEST_FILE)) as f:
+            version_dir = os.path.join(model_dir, f.read().strip())
+    except FileNotFoundError:
+        return None
+    return version_dir if os.path.isdir(version_dir) else None
+
+def is_stale_version(version_dir, base_model_path=MODEL_FILE):
+    """Whether a published version was fine-tuned from a base model other than the current one.
+
+    Versions record the tag (path and modification time) of the base model they started
+    from; versions published before that was recorded are stale when the base is newer.
+    """
+    if not os.path.exists(base_model_path):
+        return False
+    try:
+        with open(os.path.join(version_dir, STATE_FILE)) as f:
+            base_tag = json.load(f).get('base_model_tag')
+    except (OSError, ValueError):
+        base_tag = None
+    if base_tag is not None:
+        return base_tag != get_model_tag(base_model_path)
+    model_file = os.path.join(version_dir, MODEL_FILE)
+    return not os.path.exists(model_file) or os.path.getmtime(base_model_path) > os.path.getmtime(model_file)
+
+def load_latest_classifier(model_dir=MODEL_DIR, base_model_path=MODEL_FILE):
+    """Load the latest published classifier, or None if nothing has been published or the
+    latest version was fine-tuned from an older base model than base_model_path"""
+    version_dir = latest_model_version(model_dir)
+    if version_dir is None:
+        return None
+    if is_stale_version(version_dir, base_model_path):
+        print(f"Ignoring {version_dir}: {base_model_path} has been retrained since it was published")
+        return None
+    classifier = MusicEmotionClassifier()
+    classifier.load_model(os.path.join(version_dir, MODEL_FILE), os.path.join(version_dir, SCALER_FILE))
+    return classifier
+
+def spotify_feature_lookup(track_ids):
+    """Fetch model features for tracks from the Spotify API (audio features plus popularity)"""
+    from recommend_spotify_playlist_music_for_tiktok_edits import get_spotify_client
+    from request_scheduler import spotify_scheduler
+    client = get_spotify_client()
+    audio_features = spotify_scheduler.call(client.audio_features, track_ids)
+    tracks = spotify_scheduler.call(client.tracks, track_ids)['tracks']
+    features = {}
+    for track_id, audio, track in zip(track_ids, audio_features, tracks):
+        if audio and track:
+            features[track_id] = dict(audio, popularity=track.get('popularity', 0))
+    return features
+
+class OnlineLearner:
+    """Applies recommendation feedback to the emotion classifier without a full retrain.
+
+    New feedback is read from the log in mini-batches; each batch is mixed with an
+    equal number of examples from the replay buffer and applied with train_on_batch.
+    A chosen track is pushed towards the video's emotion, a skipped one away from it,
+    leaving its other emotion probabilities as the model currently predicts them.
+    The feature scaler stays as fitted by the original training. Model versions are
+    published to model_dir atomically, so readers keep using the previous version
+    until the new one is complete.
+    """
+    def __init__(self, model_dir=MODEL_DIR, feedback_log=None, base_model_path=MODEL_FILE,
+                 base_scaler_path=SCALER_FILE, batch_size=32, replay_capacity=10000,
+                 feature_lookup=spotify_feature_lookup, keep_versions=5, learning_rate=1e-4):
+        self.model_dir = model_dir
+        self.feedback_log = feedback_log or FeedbackLog()
+        self.batch_size = batch_size
+        self.feature_lookup = feature_lookup
+        self.keep_versions = keep_versions
+        self.offset = 0
+        self.updates = 0
+        self.events_applied = 0
+        self.updates_since_publish = 0
+
+        # Continue from the latest published version, or start from the batch-trained model.
+        # After the base model is retrained, start over from it and re-apply the whole feedback log.
+        self.classifier = MusicEmotionClassifier()
+        self.base_model_tag = get_model_tag(base_model_path)
+        version_dir = latest_model_version(model_dir)
+        if version_dir is not None and is_stale_version(version_dir, base_model_path):
+            print(f"{base_model_path} has been retrained since {version_dir}; restarting from it")
+            version_dir = None
+        if version_dir is not None:
+            self.classifier.load_model(os.path.join(version_dir, MODEL_FILE), os.path.join(version_dir, SCALER_FILE))
+            with open(os.path.join(version_dir, STATE_FILE)) as f:
+                state = json.load(f)
+            self.offset = state['offset']
+            self.updates = state['updates']
+            self.events_applied = state['events_applied']
+            # Versions published before base tags were recorded belong to the current base (not stale)
+            self.base_model_tag = state.get('base_model_tag', self.base_model_tag)
+        else:
+            self.classifier.load_model(base_model_path, base_scaler_path)
+
+        # Fine-tune with a fresh optimizer and a small learning rate; the saved optimizer
+        # state isn't restored from .h5 files and full-size steps would overreact to single events
+        from keras.optimizers import Adam
+        loss = 'binary_crossentropy' if self.classifier.multi_label else 'categorical_crossentropy'
+        self.classifier.model.compile(loss=loss, optimizer=Adam(learning_rate=learning_rate))
+
+        self.replay = ReplayBuffer(replay_capacity, len(self.classifier.feature_columns),
+                                   len(self.classifier.emotion_categories))
+        if version_dir is not None and os.path.exists(os.path.join(version_dir, REPLAY_FILE)):
+            self.replay.load(os.path.join(version_dir, REPLAY_FILE))
+
+    def _examples(self, events):
+        """Turn feedback events into scaled feature rows and target emotion probabilities"""
+        categories = self.classifier.emotion_categories
+        events = [event for event in events if event.get('video_emotion') in categories]
+        missing = [event['track_id'] for event in events if 'features' not in event]
+        looked_up = self.feature_lookup(sorted(set(missing))) if missing and self.feature_lookup else {}
+
+        rows, kept = [], []
+        for event in events:
+            features = event.get('features') or looked_up.get(event['track_id'])
+            if features is None:
+                continue
+            rows.append([float(features.get(column, 0) or 0) for column in self.classifier.feature_columns])
+            kept.append(event)
+        if not rows:
+            return None, None
+
+        X = self.classifier.scaler.transform(pd.DataFrame(rows, columns=self.classifier.feature_columns))
+        X = X.astype(np.float32)
+        current = self.classifier.model.predict(X, verbose=0)
+        y = np.array(current, dtype=np.float32)
+        for i, event in enumerate(kept):
+            emotion = categories.index(event['video_emotion'])
+            # Keep the model's other beliefs; only the emotion the track was chosen or skipped for changes
+            y[i, emotion] = 1.0 if event['chosen'] else 0.0
+            if not self.classifier.multi_label:
+                # Older softmax models need a distribution that sums to 1
+                if event['chosen'] or y[i].sum() <= 0:
+                    y[i] = 0.0 if event['chosen'] else 1.0
+                    y[i, emotion] = 1.0 if event['chosen'] else 0.0
+                y[i] /= y[i].sum()
+        return X, y
+
+    def update_from_log(self, max_events=1000):
+        """Apply up to max_events new feedback events and return how many were read.
+
+        Events that can't be used (unknown emotion, no features) are read and skipped, so
+        a return value of 0 means the log has nothing new, not that nothing was applied.
+        """
+        events, next_offset = self.feedback_log.read(self.offset, max_events)
+        if not events:
+            return 0
+
+        with span('online_update', events=len(events)):
+            X, y = self._examples(events)
+            applied = 0
+            if X is not None:
+                for start in range(0, len(X), self.batch_size):
+                    X_new, y_new = X[start:start + self.batch_size], y[start:start + self.batch_size]
+                    X_replay, y_replay = self.replay.sample(len(X_new))
+                    self.classifier.model.train_on_batch(np.concatenate([X_new, X_replay]),
+                                                         np.concatenate([y_new, y_replay]))
+                    self.replay.add(X_new, y_new)
+                    self.updates += 1
+                    self.updates_since_publish += 1
+                applied = len(X)
+        self.offset = next_offset
+        self.events_applied += applied
+        print(f"Applied {applied} of {len(events)} feedback events ({self.updates} updates in total)")
+        return len(events)
+
+    def publish(self):
+        """Write the current model as a new version and point LATEST at it"""
+        os.makedirs(self.model_dir, exist_ok=True)
+        existing = [int(name[1:]) for name in os.listdir(self.model_dir) if name[:1] == 'v' and name[1:].isdigit()]
+        version = f"v{max(existing, default=0) + 1:04d}"
+
+        # Build the version in a temporary directory, then rename it into place in one step
+        tmp_dir = os.path.join(self.model_dir, f'.tmp-{version}')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        self.classifier.save_model(os.path.join(tmp_dir, MODEL_FILE), os.path.join(tmp_dir, SCALER_FILE))
+        self.replay.save(os.path.join(tmp_dir, REPLAY_FILE))
+        with open(os.path.join(tmp_dir, STATE_FILE), 'w') as f:
+            json.dump({'version': version, 'offset': self.offset, 'updates': self.updates,
+                       'events_applied': self.events_applied, 'base_model_tag': self.base_model_tag,
+                       'published': datetime.now().isoformat()}, f)
+        os.rename(tmp_dir, os.path.join(self.model_dir, version))
+
+        latest_tmp = os.path.join(self.model_dir, LATEST_FILE + '.tmp')
+        with open(latest_tmp, 'w') as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(latest_tmp, os.path.join(self.model_dir, LATEST_FILE))
+        self.updates_since_publish = 0
+        print(f"Published model {version}")
+
+        # Drop old versions; readers only ever open the one LATEST points at
+        for old in sorted(existing)[:max(len(existing) + 1 - self.keep_versions, 0)]:
+            shutil.rmtree(os.path.join(self.model_dir, f"v{old:04d}"), ignore_errors=True)
+        return os.path.join(self.model_dir, version)
+
+    def run(self, poll_interval=5.0, publish_every=50, publish_interval=300.0, max_iterations=None):
+        """Keep applying feedback as it arrives, publishing after publish_every updates or publish_interval seconds"""
+        last_publish = time.monotonic()
+        iteration = 0
+        while max_iterations is None or iteration < max_iterations:
+            iteration += 1
+            read = self.update_from_log()
+            due = time.monotonic() - last_publish >= publish_interval
+            if self.updates_since_publish and (self.updates_since_publish >= publish_every or due):
+                self.publish()
+                last_publish = time.monotonic()
+            if not read:
+                time.sleep(poll_interval)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Update the emotion classifier from recommendation feedback')
+    parser.add_argument('--feedback-log', default=FEEDBACK_LOG, help='Feedback log to read')
+    parser.add_argument('--model-dir', default=MODEL_DIR, help='Directory for published model versions')
+    parser.add_argument('--watch', action='store_true', help='Keep running and apply feedback as it arrives')
+    parser.add_argument('--publish-every', type=int, default=50, help='Publish after this many mini-batch updates')
+    parser.add_argument('--poll-interval', type=float, default=5.0, help='Seconds between checks for new feedback')
+    args = parser.parse_args()
+
+    learner = OnlineLearner(args.model_dir, FeedbackLog(args.feedback_log))
+    if args.watch:
+        learner.run(args.poll_interval, args.publish_every)
+    else:
+        while learner.update_from_log():
+            pass
+        if learner.updates_since_publish:
+            learner.publish()
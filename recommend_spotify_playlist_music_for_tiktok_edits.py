@@ -1,78 +1,145 @@
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-import pandas as pd
-import sys
-import random
-# Spotify API credentials
-# Load credentials from .env file
+"""Spotify playlist discovery and metadata ingestion.
+
+Importing this module makes no API calls and loads nothing heavy: the Spotify
+client, pandas and the .env file are only loaded when a function needs them.
+"""
 import os
-from dotenv import load_dotenv
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import traced, in_current_context
+from request_scheduler import spotify_scheduler
+from checkpoint import IngestionCheckpoint, default_checkpoint_path
 
-# Load environment variables
-load_dotenv()
+# Spotify returns at most 50 playlists per search page and 1000 results per query
+SEARCH_PAGE_SIZE = 50
+MAX_SEARCH_RESULTS = 1000
 
-# Get credentials from environment variables
-SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
-SPOTIFY_CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
+# Queries used to discover playlists when running this module as a script
+DISCOVERY_QUERIES = ['pop', 'hits']
 
-# Initialize Spotify client
-sp = spotipy.Spotify(
-    client_id=SPOTIFY_CLIENT_ID,
-    client_secret=SPOTIFY_CLIENT_SECRET,
-    auth_manager=SpotifyClientCredentials()
-)
+# Fallback playlist IDs from Spotify (Verified to work in most regions)
+# Today's Top Hits, Spotify Global Top 50, Global Viral 50
+FALLBACK_PLAYLISTS = [
+    ("37i9dQZF1DXcBWIGoYBM5M", "Today's Top Hits"),
+    ("37i9dQZF1DXcBWIGoYBM5M", "Top 50 - Global"),
+    ("37i9dQZF1DXa2EiKmMLhFD", "Release Radar"),
+    ("37i9dQZEVXbNG2KDcFcKOF", "Spotify Viral 50")
+]
 
-# Function to search for playlists
-def search_playlists(query, limit=5):
+# Spotify client, created on first use so that importing this module makes no API calls
+sp = None
+
+def get_spotify_client():
+    """Return the Spotify client, creating the default pooled client if none has been set"""
+    global sp
+    if sp is None:
+        from dotenv import load_dotenv
+        from spotify_client import SpotifyClient
+
+        # Load credentials from .env file
+        load_dotenv()
+        # The client makes a single attempt per call; 429s and their Retry-After
+        # header reach the request scheduler, which does all the retrying
+        sp = SpotifyClient(client_id=os.getenv('SPOTIFY_CLIENT_ID'), client_secret=os.getenv('SPOTIFY_CLIENT_SECRET'))
+    return sp
+
+def set_spotify_client(client):
+    """Use a different Spotify client backend (e.g. a fake from fake_backends)"""
+    global sp
+    sp = client
+
+def _search_playlist_page(query, limit, offset):
+    """One page of playlist search results, or None if the request failed after retries"""
     try:
-        print(f"Searching for playlists with query: '{query}'")
-        results = sp.search(q=query, type='playlist', limit=limit)
-        
-        if not results or 'playlists' not in results or 'items' not in results['playlists']:
-            print(f"No valid playlist results found for query: '{query}'")
-            return []
-            
-        playlists = results['playlists']['items']
-        
-        if not playlists:
-            print(f"No playlists found for query: '{query}'")
-            return []
-            
-        print(f"Found {len(playlists)} playlists:")
-        valid_playlists = []
-        
-        for i, playlist in enumerate(playlists):
-            try:
-                # Only include playlists with required fields
-                if 'id' in playlist and 'name' in playlist:
-                    playlist_name = playlist['name']
-                    playlist_id = playlist['id']
-                    
-                    # Get owner display name safely
-                    owner_name = "Unknown user"
-                    if 'owner' in playlist and playlist['owner'] and 'display_name' in playlist['owner']:
-                        owner_name = playlist['owner']['display_name']
-                    
-                    # Get track count safely
-                    track_count = 0
-                    if 'tracks' in playlist and playlist['tracks'] and 'total' in playlist['tracks']:
-                        track_count = playlist['tracks']['total']
-                    
-                    print(f"{i+1}. {playlist_name} (ID: {playlist_id}) by {owner_name} - {track_count} tracks")
-                    valid_playlists.append(playlist)
-            except Exception as e:
-                print(f"Error processing playlist {i+1}: {e}")
-                continue
-                
-        return valid_playlists
+        results = spotify_scheduler.call(get_spotify_client().search, q=query, type='playlist',
+                                         limit=limit, offset=offset)
     except Exception as e:
-        print(f"Error searching for playlists: {e}")
+        print(f"Error searching for playlists with query '{query}' at offset {offset}: {e}")
+        return None
+    return (results or {}).get('playlists') or {}
+
+def _playlist_summary(playlist):
+    owner = playlist.get('owner') or {}
+    tracks = playlist.get('tracks') or playlist.get('items') or {}
+    return {
+        'id': playlist['id'],
+        'name': playlist.get('name', ''),
+        'owner': owner.get('display_name') or "Unknown user",
+        'track_count': tracks.get('total') or 0,
+        'queries': []
+    }
+
+def discover_playlists(queries, max_results_per_query=100, min_tracks=0, max_workers=None):
+    """Search playlists for many queries concurrently, deduplicated by ID and ranked by track count.
+
+    Each query is paginated up to max_results_per_query results: the first page of
+    every query is requested at once, then all remaining pages at once. Returns dicts
+    with id, name, owner, track_count and the queries that found the playlist.
+    """
+    queries = [queries] if isinstance(queries, str) else list(queries)
+    max_results = min(max_results_per_query, MAX_SEARCH_RESULTS)
+    page_size = min(SEARCH_PAGE_SIZE, max_results)
+    if not queries or page_size <= 0:
         return []
 
+    with ThreadPoolExecutor(max_workers=max_workers or spotify_scheduler.max_concurrency) as executor:
+        # First pages report how many results each query has
+        search_page = in_current_context(lambda query, offset: _search_playlist_page(query, page_size, offset))
+        first_pages = list(executor.map(search_page, queries, [0] * len(queries)))
+        more = [(query, offset) for query, page in zip(queries, first_pages) if page
+                for offset in range(page_size, min(page.get('total') or 0, max_results), page_size)]
+        more_pages = list(executor.map(search_page, *zip(*more))) if more else []
+
+    playlists = {}
+    for query, page in list(zip(queries, first_pages)) + [(query, page) for (query, _), page in zip(more, more_pages)]:
+        for playlist in (page or {}).get('items') or []:
+            # Search results contain null entries for playlists that are no longer available
+            if not playlist or not playlist.get('id'):
+                continue
+            summary = playlists.setdefault(playlist['id'], _playlist_summary(playlist))
+            if query not in summary['queries']:
+                summary['queries'].append(query)
+
+    # sorted() is stable, so playlists with equal track counts keep their search order
+    return sorted((summary for summary in playlists.values() if summary['track_count'] >= min_tracks),
+                  key=lambda summary: -summary['track_count'])
+
+# Function to search for playlists
+def search_playlists(query, limit=5):
+    print(f"Searching for playlists with query: '{query}'")
+    playlists = discover_playlists([query], max_results_per_query=limit)
+    if not playlists:
+        print(f"No playlists found for query: '{query}'")
+        return []
+
+    print(f"Found {len(playlists)} playlists:")
+    for i, playlist in enumerate(playlists):
+        print(f"{i+1}. {playlist['name']} (ID: {playlist['id']}) by {playlist['owner']} - {playlist['track_count']} tracks")
+    return playlists
+
+def find_accessible_playlist(candidates=FALLBACK_PLAYLISTS):
+    """Probe (playlist_id, name) candidates concurrently and return the first accessible one, in order"""
+    def probe(candidate):
+        playlist_id, name = candidate
+        try:
+            playlist = spotify_scheduler.call(get_spotify_client().playlist, playlist_id, fields="id,name")
+            return playlist_id, playlist.get('name', name)
+        except Exception as e:
+            print(f"Fallback playlist {name} not accessible: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=spotify_scheduler.max_concurrency) as executor:
+        for result in executor.map(in_current_context(probe), candidates):
+            if result:
+                return result
+    return None, None
+
 # Function to get Spotify metadata for a given track
+@traced()
 def get_track_metadata(track_id):
     try:
-        track = sp.track(track_id)
+        # Transient failures and rate limits are retried by the scheduler
+        track = spotify_scheduler.call(get_spotify_client().track, track_id)
         metadata = {
             'track_id': track_id,
             'track_name': track['name'],
@@ -81,6 +148,7 @@ def get_track_metadata(track_id):
             'release_date': track['album']['release_date'],
             'duration_ms': track['duration_ms'],
             'popularity': track['popularity'],
+            'explicit': track.get('explicit', False),
             'preview_url': track.get('preview_url', '')
         }
         return metadata
@@ -89,30 +157,40 @@ def get_track_metadata(track_id):
         return None
 
 # Function to fetch Spotify metadata for songs in a playlist
-def fetch_spotify_metadata(playlist_id):
+@traced()
+def fetch_spotify_metadata(playlist_id, checkpoint_path=None):
+    import pandas as pd
     try:
         print(f"Fetching playlist with ID: {playlist_id}")
         
-        # Get tracks from the playlist
-        offset = 0
-        tracks = []
-        while True:
+        # Progress is logged as it is made, so a restarted run picks up where the last one stopped
+        checkpoint = IngestionCheckpoint(checkpoint_path or default_checkpoint_path('spotify', playlist_id))
+        
+        # Get tracks from the playlist, starting after the last checkpointed page
+        pages = checkpoint.get('playlist_page')
+        track_ids = [track_id for page in pages for track_id in page['track_ids']]
+        offset = pages[-1]['next_offset'] if pages else 0
+        while not checkpoint.get('playlist_complete'):
             try:
-                results = sp.playlist_items(playlist_id, fields="items(track(id))", offset=offset)
+                results = spotify_scheduler.call(get_spotify_client().playlist_items, playlist_id,
+                                                 fields="items(track(id))", offset=offset)
                 if not results['items']:
+                    checkpoint.append('playlist_complete', total=offset)
                     break
-                tracks.extend(results['items'])
+                page_ids = [item['track']['id'] for item in results['items'] if item['track']]
                 offset += len(results['items'])
-                print(f"Fetched {len(tracks)} tracks so far...")
+                checkpoint.append('playlist_page', next_offset=offset, track_ids=page_ids)
+                track_ids.extend(page_ids)
+                print(f"Fetched {offset} tracks so far...")
             except Exception as e:
+                # Only reached once the scheduler has given up retrying
                 print(f"Error fetching playlist items at offset {offset}: {e}")
                 break
 
-        if not tracks:
+        if not track_ids:
             print("No tracks found in playlist.")
             return pd.DataFrame()
 
-        track_ids = [track['track']['id'] for track in tracks if track['track']]
         print(f"Found {len(track_ids)} valid track IDs")
         
         # Limit to 20 tracks for testing
@@ -120,19 +198,33 @@ def fetch_spotify_metadata(playlist_id):
             print("Limiting to 20 tracks for faster processing...")
             track_ids = track_ids[:20]
 
-        # List to store the metadata
-        metadata_list = []
+        # Tracks fetched by an earlier, interrupted run
+        fetched = {record['metadata']['track_id']: record['metadata'] for record in checkpoint.get('track')}
+        if fetched:
+            print(f"Skipping {len(fetched)} tracks already fetched")
 
-        # Iterate over each track and fetch Spotify metadata
-        for i, track_id in enumerate(track_ids):
+        def fetch_track(item):
+            i, track_id = item
+            if track_id in fetched:
+                return fetched[track_id]
             print(f"Processing track {i+1}/{len(track_ids)}: {track_id}")
             track_metadata = get_track_metadata(track_id)
             if track_metadata:
-                metadata_list.append(track_metadata)
+                checkpoint.append('track', metadata=track_metadata)
+            return track_metadata
+
+        # Fetch Spotify metadata for the tracks concurrently; the shared scheduler caps
+        # concurrency and request rate, and map() keeps the playlist order
+        with ThreadPoolExecutor(max_workers=spotify_scheduler.max_concurrency) as executor:
+            metadata_list = [metadata for metadata in executor.map(in_current_context(fetch_track), enumerate(track_ids)) if metadata]
 
         # Create a dataframe from the metadata list
         df = pd.DataFrame(metadata_list)
         
+        # Only discard the checkpoint once every track has been fetched
+        if checkpoint.get('playlist_complete') and len(metadata_list) == len(track_ids):
+            checkpoint.complete()
+        
         print(f"Successfully processed {len(metadata_list)} tracks")
         return df
     except Exception as e:
@@ -140,67 +232,45 @@ def fetch_spotify_metadata(playlist_id):
         return pd.DataFrame()
 
 # Main execution
-try:
-    print("Starting Spotify metadata extraction...")
-    
-    # Fallback playlist IDs from Spotify (Verified to work in most regions)
-    # Today's Top Hits, Spotify Global Top 50, Global Viral 50
-    fallback_playlist_ids = [
-        ("37i9dQZF1DXcBWIGoYBM5M", "Today's Top Hits"),
-        ("37i9dQZF1DXcBWIGoYBM5M", "Top 50 - Global"),
-        ("37i9dQZF1DXa2EiKmMLhFD", "Release Radar"),
-        ("37i9dQZEVXbNG2KDcFcKOF", "Spotify Viral 50")
-    ]
-    
-    # Try the search approach first
-    playlist_id = None
-    playlist_name = None
-    
-    # Search for pop playlists
-    playlists = search_playlists("pop")
-    
-    if not playlists:
-        print("No playlists found with 'pop'. Trying 'hits'...")
-        playlists = search_playlists("hits")
-    
-    if playlists:
-        # Use the first playlist from search results
-        selected_playlist = playlists[0]
-        playlist_id = selected_playlist['id']
-        playlist_name = selected_playlist['name']
-        print(f"Using playlist from search: {playlist_name} (ID: {playlist_id})")
-    else:
-        # Try fallback playlists
-        print("No playlists found via search. Trying fallback playlists...")
+def main():
+    try:
+        print("Starting Spotify metadata extraction...")
         
-        for fallback_id, fallback_name in fallback_playlist_ids:
-            try:
-                # Test if the playlist exists
-                test = sp.playlist(fallback_id, fields="id,name")
-                playlist_id = fallback_id
-                playlist_name = test.get('name', fallback_name)
+        # Search all discovery queries at once and use the largest playlist found
+        playlists = discover_playlists(DISCOVERY_QUERIES)
+        
+        if playlists:
+            print(f"Found {len(playlists)} playlists:")
+            for i, playlist in enumerate(playlists[:10]):
+                print(f"{i+1}. {playlist['name']} (ID: {playlist['id']}) by {playlist['owner']} - {playlist['track_count']} tracks")
+            playlist_id = playlists[0]['id']
+            playlist_name = playlists[0]['name']
+            print(f"Using playlist from search: {playlist_name} (ID: {playlist_id})")
+        else:
+            print("No playlists found via search. Trying fallback playlists...")
+            playlist_id, playlist_name = find_accessible_playlist()
+            if playlist_id:
                 print(f"Using fallback playlist: {playlist_name} (ID: {playlist_id})")
-                break
-            except Exception as e:
-                print(f"Fallback playlist {fallback_name} not accessible: {e}")
-                continue
-    
-    if not playlist_id:
-        print("Could not find any accessible playlists. Exiting.")
-        sys.exit(1)
-    
-    # Fetch metadata from the selected playlist
-    df = fetch_spotify_metadata(playlist_id)
-    
-    if df.empty:
-        print("No data was fetched. Exiting.")
-        sys.exit(1)
         
-    # Export the dataframe to an Excel file
-    safe_name = ''.join(c if c.isalnum() or c == ' ' else '_' for c in playlist_name)
-    output_file = f'spotify_metadata_{safe_name.replace(" ", "_")}.xlsx'
-    df.to_excel(output_file, index=False)
-    print("Data exported to", output_file)
-except Exception as e:
-    print(f"Error in main execution: {e}")
-    sys.exit(1)
+        if not playlist_id:
+            print("Could not find any accessible playlists. Exiting.")
+            sys.exit(1)
+        
+        # Fetch metadata from the selected playlist
+        df = fetch_spotify_metadata(playlist_id)
+        
+        if df.empty:
+            print("No data was fetched. Exiting.")
+            sys.exit(1)
+            
+        # Export the dataframe to an Excel file
+        safe_name = ''.join(c if c.isalnum() or c == ' ' else '_' for c in playlist_name)
+        output_file = f'spotify_metadata_{safe_name.replace(" ", "_")}.xlsx'
+        df.to_excel(output_file, index=False)
+        print("Data exported to", output_file)
+    except Exception as e:
+        print(f"Error in main execution: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import random
+import threading
+import time
+
+from instrumentation import record_api_call, record_retry
+
+# HTTP status codes worth retrying: rate limited, or a transient server/gateway failure
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Exception class names (from requests, urllib3, aiohttp and google.api_core) that indicate a transient failure
+RETRYABLE_ERROR_NAMES = {
+    'ConnectionError', 'Timeout', 'ReadTimeout', 'ConnectTimeout', 'TimeoutError',
+    'ProtocolError', 'DeadlineExceeded', 'RetryError', 'ClientConnectionError', 'ClientPayloadError'
+}
+
+class TokenBucket:
+    """Thread-safe token bucket limiting how many requests start per second"""
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Block until a token is available and return how long we waited"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        """Stop handing out tokens for the given time, e.g. after a 429 with Retry-After"""
+        with self.lock:
+            now = time.monotonic()
+            self.paused_until = max(self.paused_until, now + seconds)
+            # Don't let a burst of queued requests fire the moment the pause ends
+            self.tokens = 0
+            self.updated = max(self.updated, now)
+
+def get_retry_after(error):
+    """Return the Retry-After delay in seconds carried by an error, if any"""
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        value = headers.get('Retry-After') or headers.get('retry-after')
+    except AttributeError:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def get_status_code(error):
+    """Return the HTTP status of an API error from spotipy, requests or google.api_core"""
+    # SpotifyException and SpotifyAPIError use http_status, google.api_core exceptions use code
+    for attribute in ('http_status', 'code', 'status_code'):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int) and 100 <= value < 600:
+            return value
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+def is_retryable(error):
+    """Decide whether an error is transient and the request should be retried"""
+    status = get_status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+class RequestScheduler:
+    """Runs API calls under a shared rate limit and concurrency cap, retrying transient failures.
+
+    Calls are retried with jittered exponential backoff; a 429 with a Retry-After
+    header pauses every caller sharing the scheduler for that long.
+    """
+    def __init__(self, name, rate=10.0, burst=None, max_concurrency=8, max_retries=5,
+                 base_delay=0.5, max_delay=30.0):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff_delay(self, attempt):
+        """Full-jitter exponential backoff for the given retry attempt (0-based)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, func, *args, **kwargs):
+        """Call func(*args, **kwargs) through the scheduler and return its result"""
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            with self.semaphore:
+                record_api_call(self.name)
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_retryable(e):
+                        raise
+                    error = e
+
+            retry_after = get_retry_after(error)
+            if retry_after is not None:
+                self.bucket.pause(retry_after)
+                delay = retry_after
+            else:
+                delay = self.backoff_delay(attempt)
+            attempt += 1
+            record_retry(self.name)
+            print(f"{self.name} request failed ({error}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+            time.sleep(delay)
+
+# Shared schedulers, one per API, so that every caller in the process respects the same limits
+spotify_scheduler = RequestScheduler('spotify', rate=10.0, burst=20, max_concurrency=8)
+video_intelligence_scheduler = RequestScheduler('video_intelligence', rate=2.0, burst=4, max_concurrency=4,
+                                                base_delay=2.0, max_delay=60.0)
+cloud_storage_scheduler = RequestScheduler('cloud_storage', rate=50.0, burst=100, max_concurrency=16)
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+# Audio features compared when measuring how similar two recommended tracks sound
+SIMILARITY_FEATURES = ['danceability', 'energy', 'valence', 'acousticness', 'instrumentalness',
+                       'speechiness', 'liveness', 'loudness', 'tempo']
+
+def select_candidate_pool(relevance, pool_size):
+    """Indices of the pool_size most relevant tracks, found in linear time with argpartition"""
+    relevance = np.asarray(relevance, dtype=float)
+    if pool_size >= len(relevance):
+        return np.arange(len(relevance))
+    return np.argpartition(-relevance, pool_size - 1)[:pool_size]
+
+def track_vectors(features, emotion_scores=None, emotion_weight=1.0):
+    """Unit-length vectors of standardized audio features, plus emotion probabilities when given"""
+    features = np.asarray(features, dtype=np.float32)
+    std = features.std(axis=0)
+    vectors = (features - features.mean(axis=0)) / np.where(std > 0, std, 1.0)
+    if emotion_scores is not None:
+        vectors = np.hstack([vectors, emotion_weight * np.asarray(emotion_scores, dtype=np.float32)])
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+def _mmr_pick(pool, selected, relevance, features, artists, emotion_scores, k, diversity, max_per_artist):
+    """Extend selected (positions in pool) by MMR until k tracks are picked or none are left in the pool"""
+    # Relevance on a 0-1 scale so it is comparable with cosine similarity
+    pool_relevance = relevance[pool]
+    spread = pool_relevance.max() - pool_relevance.min()
+    pool_relevance = (pool_relevance - pool_relevance.min()) / spread if spread > 0 else np.ones(len(pool))
+
+    vectors = track_vectors(features[pool], None if emotion_scores is None else emotion_scores[pool])
+    if selected:
+        max_similarity = (vectors @ vectors[selected].T).max(axis=1)
+    else:
+        max_similarity = np.zeros(len(pool))
+    available = np.ones(len(pool), dtype=bool)
+    available[selected] = False
+
+    if artists is not None:
+        artist_codes, _ = pd.factorize(artists[pool])
+        artist_counts = np.bincount(artist_codes[selected], minlength=artist_codes.max() + 1)
+        available &= artist_counts[artist_codes] < max_per_artist
+    else:
+        artist_codes = None
+
+    while len(selected) < k and available.any():
+        mmr = (1 - diversity) * pool_relevance - diversity * max_similarity
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, vectors @ vectors[best])
+
+        if artist_codes is not None:
+            artist = artist_codes[best]
+            artist_counts[artist] += 1
+            if artist_counts[artist] >= max_per_artist:
+                available[artist_codes == artist] = False
+    return selected
+
+def mmr_rerank(relevance, features, artists=None, emotion_scores=None, k=10, diversity=0.3,
+               max_per_artist=2, pool_size=None):
+    """Pick k tracks by maximal marginal relevance, with at most max_per_artist tracks per artist.
+
+    Only the pool_size most relevant tracks (default 20 * k) are considered at first. Each step
+    picks the track maximizing (1 - diversity) * relevance - diversity * (highest similarity
+    to a track already picked), and that highest similarity is updated incrementally with one
+    matrix-vector product per pick. When artist caps leave nothing to pick in the pool, it is
+    doubled with the next most relevant tracks, so fewer than k tracks are only returned when
+    the whole input has no more eligible tracks. Returns indices into the inputs, in ranked order.
+    """
+    relevance = np.asarray(relevance, dtype=float)
+    features = np.asarray(features)
+    emotion_scores = None if emotion_scores is None else np.asarray(emotion_scores)
+    artists = np.asarray(artists) if artists is not None and max_per_artist else None
+    n = len(relevance)
+    k = min(k, n)
+    if k <= 0:
+        return np.array([], dtype=int)
+    pool = select_candidate_pool(relevance, pool_size or 20 * k)
+
+    selected = []
+    while True:
+        selected = _mmr_pick(pool, selected, relevance, features, artists, emotion_scores,
+                             k, diversity, max_per_artist)
+        if len(selected) >= k or len(pool) >= n:
+            break
+        # Everything left in the pool is by capped artists; add the next most relevant tracks
+        outside = np.setdiff1d(np.arange(n), pool, assume_unique=True)
+        pool = np.concatenate([pool, outside[select_candidate_pool(relevance[outside], len(pool))]])
+
+    return pool[selected]
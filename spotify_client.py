@@ -0,0 +1,257 @@
+import asyncio
+import atexit
+import base64
+import contextvars
+import os
+import threading
+import time
+
+import aiohttp
+
+from instrumentation import record_api_call, record_retry
+from request_scheduler import get_retry_after, is_retryable, spotify_scheduler
+
+SPOTIFY_API_URL = 'https://api.spotify.com/v1/'
+SPOTIFY_TOKEN_URL = 'https://accounts.spotify.com/api/token'
+
+# Refresh the access token this long before Spotify says it expires
+TOKEN_REFRESH_MARGIN = 60
+
+class SpotifyAPIError(Exception):
+    """Error response from the Spotify Web API.
+
+    Carries http_status and headers like spotipy's SpotifyException, so the request
+    scheduler can tell retryable failures apart and honour Retry-After.
+    """
+    def __init__(self, http_status, msg, url=None, headers=None):
+        super().__init__(f"HTTP {http_status} for {url}: {msg}")
+        self.http_status = http_status
+        self.msg = msg
+        self.url = url
+        self.headers = headers or {}
+
+def _spotify_id(value):
+    """Accept a bare ID, a spotify:type:id URI or an open.spotify.com URL"""
+    value = value.split('?')[0].rstrip('/')
+    return value.replace(':', '/').split('/')[-1]
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+async def _run_in_context(coroutine, context):
+    """Await coroutine with the context variables of a caller on another thread"""
+    for variable, value in context.items():
+        variable.set(value)
+    return await coroutine
+
+class AsyncSpotifyClient:
+    """asyncio Spotify Web API client with a shared keep-alive connection pool.
+
+    One aiohttp session (and its connection pool) serves every request, the
+    client-credentials token is cached until shortly before it expires, and
+    multi-page or multi-batch calls are sent concurrently. When a scheduler is
+    given, requests share its rate limit and are retried like RequestScheduler.call.
+    """
+    def __init__(self, client_id=None, client_secret=None, auth=None, api_url=SPOTIFY_API_URL,
+                 token_url=SPOTIFY_TOKEN_URL, max_connections=32, max_concurrency=16,
+                 scheduler=spotify_scheduler, timeout=30):
+        self.client_id = client_id or os.getenv('SPOTIFY_CLIENT_ID') or os.getenv('SPOTIPY_CLIENT_ID')
+        self.client_secret = client_secret or os.getenv('SPOTIFY_CLIENT_SECRET') or os.getenv('SPOTIPY_CLIENT_SECRET')
+        self.api_url = api_url if api_url.endswith('/') else api_url + '/'
+        self.token_url = token_url
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.scheduler = scheduler
+        self.timeout = timeout
+        # A fixed token (auth) never expires; otherwise one is fetched with client credentials
+        self._token = auth
+        self._token_expires = float('inf') if auth else 0.0
+        self._session = None
+        self._token_lock = None
+        self._semaphore = None
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._token_lock = asyncio.Lock()
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def get_access_token(self, refresh=False):
+        """Return a cached access token, requesting a new one when it is missing or about to expire"""
+        session = await self._get_session()
+        async with self._token_lock:
+            if not refresh and self._token and time.monotonic() < self._token_expires - TOKEN_REFRESH_MARGIN:
+                return self._token
+            if not self.client_id or not self.client_secret:
+                raise SpotifyAPIError(401, "No Spotify client credentials configured", self.token_url)
+            credentials = base64.b64encode(f"{self.client_id}:{self.client_secret}".encode()).decode()
+            async with session.post(self.token_url, data={'grant_type': 'client_credentials'},
+                                    headers={'Authorization': f'Basic {credentials}'}) as response:
+                body = await response.json(content_type=None)
+                if response.status != 200:
+                    raise SpotifyAPIError(response.status, body, self.token_url, dict(response.headers))
+            self._token = body['access_token']
+            self._token_expires = time.monotonic() + body.get('expires_in', 3600)
+            return self._token
+
+    async def _send(self, url, params):
+        session = await self._get_session()
+        token = await self.get_access_token()
+        async with self._semaphore:
+            for attempt in range(2):
+                async with session.get(url, params=params, headers={'Authorization': f'Bearer {token}'}) as response:
+                    if response.status == 401 and attempt == 0 and self.client_id:
+                        # Token revoked or expired early; fetch a new one and try once more
+                        token = await self.get_access_token(refresh=True)
+                        continue
+                    body = await response.json(content_type=None) if response.content_length != 0 else None
+                    if response.status >= 400:
+                        message = body.get('error', {}).get('message') if isinstance(body, dict) else body
+                        raise SpotifyAPIError(response.status, message, url, dict(response.headers))
+                    return body
+
+    async def _get(self, path, **params):
+        """GET an API path (or absolute URL), retrying through the scheduler when there is one"""
+        url = path if path.startswith('http') else self.api_url + path
+        params = {key: value for key, value in params.items() if value is not None}
+        if self.scheduler is None:
+            return await self._send(url, params)
+
+        attempt = 0
+        while True:
+            # The token bucket is shared with threaded callers, so wait for it off the event loop
+            await asyncio.to_thread(self.scheduler.bucket.acquire)
+            record_api_call(self.scheduler.name)
+            try:
+                return await self._send(url, params)
+            except Exception as e:
+                if attempt >= self.scheduler.max_retries or not is_retryable(e):
+                    raise
+                error = e
+
+            retry_after = get_retry_after(error)
+            if retry_after is not None:
+                self.scheduler.bucket.pause(retry_after)
+                delay = retry_after
+            else:
+                delay = self.scheduler.backoff_delay(attempt)
+            attempt += 1
+            record_retry(self.scheduler.name)
+            print(f"{self.scheduler.name} request failed ({error}), retry {attempt}/{self.scheduler.max_retries} "
+                  f"in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def search(self, q, limit=10, offset=0, type='track', market=None):
+        return await self._get('search', q=q, limit=limit, offset=offset, type=type, market=market)
+
+    async def playlist(self, playlist_id, fields=None, market=None):
+        return await self._get(f'playlists/{_spotify_id(playlist_id)}', fields=fields, market=market)
+
+    async def playlist_items(self, playlist_id, fields=None, limit=100, offset=0, market=None):
+        return await self._get(f'playlists/{_spotify_id(playlist_id)}/tracks', fields=fields, limit=limit,
+                               offset=offset, market=market)
+
+    # spotipy's older name for the same endpoint
+    playlist_tracks = playlist_items
+
+    async def all_playlist_items(self, playlist_id, fields=None, page_size=100, market=None):
+        """Every item in a playlist; after the first page, the remaining pages are requested concurrently"""
+        if fields and 'total' not in fields.split(','):
+            fields += ',total'
+        first = await self.playlist_items(playlist_id, fields=fields, limit=page_size, market=market)
+        offsets = range(page_size, first.get('total', 0), page_size)
+        pages = await asyncio.gather(*[self.playlist_items(playlist_id, fields=fields, limit=page_size,
+                                                           offset=offset, market=market) for offset in offsets])
+        return [item for page in [first, *pages] for item in page['items']]
+
+    async def track(self, track_id, market=None):
+        return await self._get(f'tracks/{_spotify_id(track_id)}', market=market)
+
+    async def tracks(self, tracks, market=None):
+        """Full track objects, fetched in concurrent batches of 50"""
+        ids = [_spotify_id(track) for track in tracks]
+        results = await asyncio.gather(*[self._get('tracks', ids=','.join(batch), market=market)
+                                         for batch in _chunks(ids, 50)])
+        return {'tracks': [track for result in results for track in result['tracks']]}
+
+    async def audio_features(self, tracks):
+        """Audio features for the tracks, fetched in concurrent batches of 100"""
+        if isinstance(tracks, str):
+            tracks = [tracks]
+        ids = [_spotify_id(track) for track in tracks]
+        results = await asyncio.gather(*[self._get('audio-features', ids=','.join(batch))
+                                         for batch in _chunks(ids, 100)])
+        return [features for result in results for features in result['audio_features']]
+
+    async def next(self, result):
+        """The next page of a paged result, or None on the last page"""
+        return await self._get(result['next']) if result.get('next') else None
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+class SpotifyClient:
+    """Synchronous facade over AsyncSpotifyClient with the spotipy methods this project calls.
+
+    Requests run on a private event loop in a background thread, so the connection
+    pool and token are shared by every calling thread. By default the facade does
+    not rate limit or retry by itself: callers wrap calls in spotify_scheduler.call.
+    """
+    def __init__(self, scheduler=None, **client_options):
+        self.aio = AsyncSpotifyClient(scheduler=scheduler, **client_options)
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _run(self, coroutine):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='spotify-client', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+        # Carry the caller's context (e.g. its open instrumentation spans) onto the event loop thread
+        return asyncio.run_coroutine_threadsafe(_run_in_context(coroutine, contextvars.copy_context()),
+                                                self._loop).result()
+
+    def search(self, q, limit=10, offset=0, type='track', market=None):
+        return self._run(self.aio.search(q, limit=limit, offset=offset, type=type, market=market))
+
+    def playlist(self, playlist_id, fields=None, market=None):
+        return self._run(self.aio.playlist(playlist_id, fields=fields, market=market))
+
+    def playlist_items(self, playlist_id, fields=None, limit=100, offset=0, market=None):
+        return self._run(self.aio.playlist_items(playlist_id, fields=fields, limit=limit, offset=offset, market=market))
+
+    playlist_tracks = playlist_items
+
+    def all_playlist_items(self, playlist_id, fields=None, page_size=100, market=None):
+        return self._run(self.aio.all_playlist_items(playlist_id, fields=fields, page_size=page_size, market=market))
+
+    def track(self, track_id, market=None):
+        return self._run(self.aio.track(track_id, market=market))
+
+    def tracks(self, tracks, market=None):
+        return self._run(self.aio.tracks(tracks, market=market))
+
+    def audio_features(self, tracks):
+        return self._run(self.aio.audio_features(tracks))
+
+    def next(self, result):
+        return self._run(self.aio.next(result))
+
+    def close(self):
+        """Close the connection pool and stop the background event loop"""
+        with self._lock:
+            if self._loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self.aio.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            atexit.unregister(self.close)
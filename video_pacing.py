@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+# Tempo range that target tempos are folded into (half/double time feels the same against the cuts)
+MIN_TARGET_TEMPO = 70.0
+MAX_TARGET_TEMPO = 180.0
+
+# Cuts per minute at which the target energy reaches about 63%
+ENERGY_CUT_RATE = 30.0
+
+def _segment_quantile(sorted_values, offsets, counts, q):
+    """Linear-interpolated quantile of each segment of an array sorted within segments"""
+    position = (counts - 1) * q
+    lower = np.floor(position).astype(int)
+    upper = np.minimum(lower + 1, counts - 1)
+    fraction = position - lower
+    return sorted_values[offsets + lower] * (1 - fraction) + sorted_values[offsets + upper] * fraction
+
+def fold_tempo(tempo, low=MIN_TARGET_TEMPO, high=MAX_TARGET_TEMPO):
+    """Double or halve tempos until they fall in [low, high]"""
+    tempo = np.asarray(tempo, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        up = np.where(tempo < low, 2.0 ** np.ceil(np.log2(low / tempo)), 1.0)
+        down = np.where(tempo > high, 2.0 ** np.ceil(np.log2(tempo / high)), 1.0)
+    return tempo * up / down
+
+def compute_pacing(shot_df):
+    """Compute pacing statistics for every video in a Shot Detection table at once.
+
+    Returns a DataFrame indexed by video with the cut rate, shot-length distribution,
+    cut-rhythm periodicity and the tempo/energy targets derived from them.
+    """
+    shots = shot_df.dropna(subset=['Start Time', 'End Time'])
+    codes, videos = pd.factorize(shots['Video'])
+    starts = shots['Start Time'].to_numpy(dtype=float)
+    ends = shots['End Time'].to_numpy(dtype=float)
+    lengths = np.maximum(ends - starts, 0.0)
+    n_videos = len(videos)
+    if n_videos == 0:
+        return pd.DataFrame()
+
+    # Order shots by video, then by start time, so each video is a contiguous segment in time order
+    order = np.lexsort((starts, codes))
+    codes, starts, ends, lengths = codes[order], starts[order], ends[order], lengths[order]
+    counts = np.bincount(codes, minlength=n_videos)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    duration = np.maximum.reduceat(ends, offsets) - np.minimum.reduceat(starts, offsets)
+    cuts_per_minute = np.where(duration > 0, (counts - 1) / np.maximum(duration, 1e-9) * 60.0, 0.0)
+
+    # Shot-length distribution
+    mean_length = np.bincount(codes, weights=lengths, minlength=n_videos) / counts
+    deviation = lengths - mean_length[codes]
+    variance = np.bincount(codes, weights=deviation ** 2, minlength=n_videos) / counts
+    std_length = np.sqrt(variance)
+    sorted_lengths = lengths[np.lexsort((lengths, codes))]
+    p10 = _segment_quantile(sorted_lengths, offsets, counts, 0.10)
+    median_length = _segment_quantile(sorted_lengths, offsets, counts, 0.50)
+    p90 = _segment_quantile(sorted_lengths, offsets, counts, 0.90)
+
+    # Cut rhythm: how regular the shot lengths are, and whether consecutive shots
+    # alternate (negative lag-1 autocorrelation) or drift (positive)
+    cv = np.where(mean_length > 0, std_length / np.maximum(mean_length, 1e-9), 0.0)
+    regularity = 1.0 / (1.0 + cv)
+    same_video = codes[1:] == codes[:-1]
+    lag_products = np.bincount(codes[1:][same_video], weights=(deviation[1:] * deviation[:-1])[same_video],
+                               minlength=n_videos)
+    total_squares = variance * counts
+    autocorrelation = np.where(total_squares > 0, lag_products / np.maximum(total_squares, 1e-12), 0.0)
+
+    # A steady cut every median-shot-length seconds lines up with a beat at 60 / length BPM,
+    # and faster cutting calls for more energetic music
+    with np.errstate(divide='ignore'):
+        cut_tempo = np.where(median_length > 0, 60.0 / median_length, np.nan)
+    target_tempo = fold_tempo(cut_tempo)
+    target_energy = 1.0 - np.exp(-cuts_per_minute / ENERGY_CUT_RATE)
+
+    return pd.DataFrame({
+        'duration': duration,
+        'shot_count': counts,
+        'cuts_per_minute': cuts_per_minute,
+        'mean_shot_length': mean_length,
+        'median_shot_length': median_length,
+        'p10_shot_length': p10,
+        'p90_shot_length': p90,
+        'shot_length_std': std_length,
+        'rhythm_regularity': regularity,
+        'rhythm_autocorrelation': autocorrelation,
+        'cut_tempo': cut_tempo,
+        'target_tempo': target_tempo,
+        'target_energy': target_energy
+    }, index=pd.Index(videos, name='Video'))
+
+def summarize_pacing(pacing_df):
+    """Combine per-video pacing into one tempo/energy target, weighting videos by duration"""
+    if pacing_df is None or pacing_df.empty:
+        return None
+    weights = pacing_df['duration'].to_numpy()
+    if weights.sum() <= 0:
+        weights = np.ones(len(pacing_df))
+    valid_tempo = ~np.isnan(pacing_df['target_tempo'].to_numpy())
+    return {
+        'cuts_per_minute': float(np.average(pacing_df['cuts_per_minute'], weights=weights)),
+        'median_shot_length': float(np.average(pacing_df['median_shot_length'], weights=weights)),
+        'rhythm_regularity': float(np.average(pacing_df['rhythm_regularity'], weights=weights)),
+        'target_tempo': float(np.average(pacing_df['target_tempo'][valid_tempo], weights=weights[valid_tempo]))
+        if valid_tempo.any() else None,
+        'target_energy': float(np.average(pacing_df['target_energy'], weights=weights))
+    }
+
+def tempo_match(tempo, target_tempo):
+    """Score 0-1 for how well track tempos fit a target, treating half and double time as matches"""
+    tempo = np.asarray(tempo, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        octaves = np.abs(np.log2(tempo / target_tempo)) % 1.0
+    distance = np.minimum(octaves, 1.0 - octaves)
+    return np.nan_to_num(1.0 - 2.0 * distance)